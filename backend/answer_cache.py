@@ -0,0 +1,106 @@
+import time
+import threading
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Reuse Gemini answers for questions whose embeddings are nearly identical.
+
+    Entries are matched by cosine similarity >= threshold, expire after ttl
+    seconds, are evicted least-recently-used beyond maxsize, and are dropped
+    whenever the document index version changes.
+    """
+
+    def __init__(self, threshold=0.95, maxsize=512, ttl=3600):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._vectors = None  # (n, dim) normalized query embeddings
+        self._entries = []
+        self._index_version = None
+
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype="float32")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, index_version):
+        if index_version != self._index_version:
+            self._vectors = None
+            self._entries = []
+            self._index_version = index_version
+
+    def _drop(self, positions):
+        keep = [i for i in range(len(self._entries)) if i not in positions]
+        self._entries = [self._entries[i] for i in keep]
+        self._vectors = self._vectors[keep] if keep else None
+
+    def lookup(self, embedding, index_version):
+        """
+        Return {"answer", "sources"} for the closest cached question, or None.
+        """
+        query = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(index_version)
+            expired = {i for i, entry in enumerate(self._entries) if entry["expires_at"] <= now}
+            if expired:
+                self._drop(expired)
+
+            if self._vectors is not None:
+                scores = self._vectors @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry = self._entries[best]
+                    entry["last_used"] = now
+                    self.hits += 1
+                    self.latency_saved += entry["latency"]
+                    return {"answer": entry["answer"], "sources": entry["sources"]}
+
+            self.misses += 1
+            return None
+
+    def store(self, embedding, index_version, answer, sources, latency=0.0):
+        vector = self._normalize(embedding).reshape(1, -1)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(index_version)
+            if len(self._entries) >= self.maxsize:
+                oldest = min(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"])
+                self._drop({oldest})
+
+            self._entries.append(
+                {
+                    "answer": answer,
+                    "sources": sources,
+                    "latency": latency,
+                    "last_used": now,
+                    "expires_at": now + self.ttl,
+                }
+            )
+            self._vectors = vector if self._vectors is None else np.vstack([self._vectors, vector])
+
+    def invalidate(self):
+        with self._lock:
+            self._vectors = None
+            self._entries = []
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "llm_calls_saved": self.hits,
+            "latency_saved_seconds": round(self.latency_saved, 3),
+        }
@@ -0,0 +1,37 @@
+import os
+import secrets
+from cache import LRUCache
+
+# Seconds a generated file stays downloadable, and how many are kept at most
+ARTIFACT_TTL = int(os.getenv("ARTIFACT_TTL", 900))
+ARTIFACT_MAX_ITEMS = int(os.getenv("ARTIFACT_MAX_ITEMS", 500))
+
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+class ArtifactStore:
+    """
+    Generated files (filled contracts) kept in memory under random ids for a
+    limited time. Each artifact belongs to the user who generated it; ids of
+    other users' artifacts resolve to nothing.
+    """
+
+    def __init__(self, ttl=ARTIFACT_TTL, max_items=ARTIFACT_MAX_ITEMS):
+        self._items = LRUCache(maxsize=max_items, ttl=ttl)
+
+    def put(self, owner, data, filename, media_type=DOCX_MEDIA_TYPE):
+        """
+        Store data and return its artifact id.
+        """
+        artifact_id = secrets.token_urlsafe(16)
+        self._items.set(artifact_id, {"owner": owner, "data": data, "filename": filename, "media_type": media_type})
+        return artifact_id
+
+    def get(self, artifact_id, owner):
+        artifact = self._items.get(artifact_id)
+        if artifact is None or artifact["owner"] != owner:
+            return None
+        return artifact
+
+    def stats(self):
+        return self._items.stats()
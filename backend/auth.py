@@ -7,12 +7,19 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from models import TokenData, User, UserInDB
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from cache import LRUCache
 
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-should-be-changed-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Authenticated users kept in memory for a few seconds, so most requests skip the Mongo lookup.
+# Writes to a user in this process invalidate its entry; the TTL bounds staleness across workers.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 4096))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 30))
+user_cache = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
 pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -38,6 +45,20 @@ async def get_user(db: AsyncIOMotorDatabase, username: str):
         return UserInDB(**user_dict)
     return None
 
+async def get_cached_user(db: AsyncIOMotorDatabase, username: str):
+    """
+    get_user through the user cache. The returned UserInDB is shared: don't modify it.
+    """
+    user = user_cache.get(username)
+    if user is None:
+        user = await get_user(db, username)
+        if user:
+            user_cache.set(username, user)
+    return user
+
+def invalidate_user(username: str):
+    user_cache.pop(username)
+
 async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncIOMotorDatabase = Depends(lambda: None)): # db dependency injected in main
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -0,0 +1,90 @@
+"""
+Compare the legal-structure chunker with the old 1000/300 recursive splitter.
+
+Usage:
+    python benchmark_chunking.py luat_lao_dong_2019.pdf [more.pdf ...] [--embed]
+
+Reports chunk count, total characters (a proxy for index size and for the context
+sent to Gemini), split time and, with --embed, the time to embed every chunk with
+keepitreal/vietnamese-sbert.
+"""
+import os
+import sys
+import time
+from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from legal_splitter import VietnameseLegalTextSplitter
+
+
+def load_pages(paths):
+    pages = []
+    for path in paths:
+        if path.lower().endswith(".pdf"):
+            docs = PyPDFLoader(path).load()
+        else:
+            docs = TextLoader(path, encoding="utf-8").load()
+        for doc in docs:
+            doc.metadata["source"] = os.path.basename(path)
+            doc.metadata.setdefault("page", 0)
+        pages.extend(docs)
+    return pages
+
+
+def run(name, split, pages, embeddings=None):
+    started = time.perf_counter()
+    chunks = split(pages)
+    split_seconds = time.perf_counter() - started
+
+    embed_seconds = None
+    if embeddings is not None:
+        started = time.perf_counter()
+        embeddings.embed_documents([chunk.page_content for chunk in chunks])
+        embed_seconds = time.perf_counter() - started
+
+    total_chars = sum(len(chunk.page_content) for chunk in chunks)
+    return {
+        "splitter": name,
+        "chunks": len(chunks),
+        "total_chars": total_chars,
+        "avg_chars": round(total_chars / len(chunks)) if chunks else 0,
+        "split_s": round(split_seconds, 3),
+        "embed_s": round(embed_seconds, 2) if embed_seconds is not None else "-",
+    }
+
+
+def main(argv):
+    paths = [arg for arg in argv if not arg.startswith("--")]
+    if not paths:
+        print(__doc__)
+        return 1
+
+    embeddings = None
+    if "--embed" in argv:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        embeddings = HuggingFaceEmbeddings(model_name="keepitreal/vietnamese-sbert")
+
+    pages = load_pages(paths)
+    print(f"Loaded {len(pages)} pages from {len(paths)} files")
+
+    recursive = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=300, separators=["\n\n", "\n", " ", ""])
+    legal = VietnameseLegalTextSplitter()
+    results = [
+        run("recursive 1000/300", recursive.split_documents, pages, embeddings),
+        run("legal structure", legal.split_documents, pages, embeddings),
+    ]
+
+    columns = ["splitter", "chunks", "total_chars", "avg_chars", "split_s", "embed_s"]
+    print(" | ".join(f"{column:>18}" for column in columns))
+    for result in results:
+        print(" | ".join(f"{str(result[column]):>18}" for column in columns))
+
+    base, new = results
+    if base["chunks"] and base["total_chars"]:
+        print(f"Chunks: {new['chunks'] / base['chunks']:.0%} of baseline, "
+              f"indexed text: {new['total_chars'] / base['total_chars']:.0%} of baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
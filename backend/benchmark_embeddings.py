@@ -0,0 +1,96 @@
+"""
+Compare the int8 ONNX embedding engine with the PyTorch one.
+
+Usage:
+    python benchmark_embeddings.py [luat_lao_dong_2019.pdf ...] [--queries 200]
+
+Reports the cosine agreement between the vectors of both engines (parity), then
+queries/sec (one embed_query call per question, as in /chat) and docs/sec
+(embed_documents over chunks, as in create_vector_db). Without files, a built-in
+set of legal sentences is used.
+"""
+import sys
+import time
+import numpy as np
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from rag_engine import EMBEDDING_MODEL, ONNX_MODEL_PATH
+from onnx_embeddings import OnnxEmbeddings
+from benchmark_chunking import load_pages
+from legal_splitter import VietnameseLegalTextSplitter
+
+QUERIES = [
+    "Người lao động được nghỉ phép năm bao nhiêu ngày?",
+    "Điều 36 Bộ luật Lao động 2019",
+    "Thời gian thử việc tối đa là bao lâu?",
+    "Mức phạt khi không đóng bảo hiểm xã hội cho người lao động",
+    "Điều kiện đơn phương chấm dứt hợp đồng lao động",
+    "Thủ tục đăng ký kết hôn với người nước ngoài",
+    "Nghị định 145/2020/NĐ-CP quy định gì về thời giờ làm việc?",
+    "Tiền lương làm thêm giờ vào ngày lễ được tính như thế nào?",
+]
+
+DOCUMENTS = [
+    "Điều 113. Nghỉ hằng năm\n1. Người lao động làm việc đủ 12 tháng cho một người sử dụng lao động thì được nghỉ hằng năm, hưởng nguyên lương theo hợp đồng lao động.",
+    "Điều 25. Thời gian thử việc\nThời gian thử việc do hai bên thỏa thuận căn cứ vào tính chất và mức độ phức tạp của công việc nhưng chỉ được thử việc một lần đối với một công việc.",
+    "Điều 98. Tiền lương làm thêm giờ, làm việc vào ban đêm\n1. Người lao động làm thêm giờ được trả lương tính theo đơn giá tiền lương hoặc tiền lương thực trả theo công việc đang làm.",
+    "Điều 36. Quyền đơn phương chấm dứt hợp đồng lao động của người sử dụng lao động\nNgười sử dụng lao động có quyền đơn phương chấm dứt hợp đồng lao động trong trường hợp người lao động thường xuyên không hoàn thành công việc.",
+] * 8
+
+
+def parity(reference, candidate, texts):
+    a = np.asarray(reference.embed_documents(texts), dtype="float32")
+    b = np.asarray(candidate.embed_documents(texts), dtype="float32")
+    cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {"min": round(float(cosine.min()), 4), "mean": round(float(cosine.mean()), 4)}
+
+
+def throughput(embeddings, queries, documents):
+    started = time.perf_counter()
+    for query in queries:
+        embeddings.embed_query(query)
+    query_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    embeddings.embed_documents(documents)
+    doc_seconds = time.perf_counter() - started
+    return {
+        "queries_per_s": round(len(queries) / query_seconds, 1),
+        "docs_per_s": round(len(documents) / doc_seconds, 1),
+    }
+
+
+def main(argv):
+    paths = [arg for arg in argv if not arg.startswith("--") and not arg.isdigit()]
+    count = int(argv[argv.index("--queries") + 1]) if "--queries" in argv else 100
+
+    documents = DOCUMENTS
+    if paths:
+        pages = load_pages(paths)
+        documents = [chunk.page_content for chunk in VietnameseLegalTextSplitter().split_documents(pages)]
+    queries = [QUERIES[i % len(QUERIES)] + f" ({i})" for i in range(count)]
+
+    torch_engine = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    onnx_engine = OnnxEmbeddings.from_model(EMBEDDING_MODEL, ONNX_MODEL_PATH)
+
+    # Warm up both engines so model loading is not timed
+    torch_engine.embed_query(QUERIES[0])
+    onnx_engine.embed_query(QUERIES[0])
+
+    print(f"Parity (cosine torch vs onnx) queries: {parity(torch_engine, onnx_engine, QUERIES)}")
+    print(f"Parity (cosine torch vs onnx) documents: {parity(torch_engine, onnx_engine, documents[:64])}")
+
+    results = {
+        "torch fp32": throughput(torch_engine, queries, documents),
+        "onnx int8": throughput(onnx_engine, queries, documents),
+    }
+    print(f"{'engine':>12} | {'queries/s':>10} | {'docs/s':>10}")
+    for name, result in results.items():
+        print(f"{name:>12} | {result['queries_per_s']:>10} | {result['docs_per_s']:>10}")
+    base, new = results["torch fp32"], results["onnx int8"]
+    print(f"Speed-up: queries x{new['queries_per_s'] / base['queries_per_s']:.2f}, "
+          f"docs x{new['docs_per_s'] / base['docs_per_s']:.2f} ({len(documents)} documents)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,194 @@
+import io
+import os
+import re
+import csv
+import json
+import asyncio
+import hashlib
+import zipfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from template_cache import render_template
+
+# Worker processes rendering contracts (defaults to one per CPU core)
+BULK_RENDER_WORKERS = int(os.getenv("BULK_RENDER_WORKERS") or os.cpu_count() or 1)
+# Largest number of variable sets accepted in one request
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", 2000))
+
+_pool = None
+# Worker process side: template bytes by version (sha256), loaded once per worker
+_worker_templates = {}
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        # Don't fork the server: it already runs Motor, embedding and ingestion threads,
+        # whose locks a forked child could inherit held. forkserver forks workers from a
+        # clean single-threaded process (spawn where forkserver isn't available).
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        _pool = ProcessPoolExecutor(max_workers=BULK_RENDER_WORKERS, mp_context=context)
+    return _pool
+
+
+def reset_pool(broken):
+    """
+    Replace the pool after a worker died (BrokenProcessPool); later submits get a new one.
+    """
+    global _pool
+    if _pool is broken:
+        print("Bulk render pool broken (a worker died), starting a new one.")
+        broken.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+    return get_pool()
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def template_version(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _render_row(template_path, version, context):
+    # Runs in a worker: read the template from the cache file once per version
+    template = _worker_templates.get(version)
+    if template is None:
+        with open(template_path, "rb") as f:
+            template = f.read()
+        if template_version(template) != version:
+            raise RuntimeError("Template changed during the batch, please retry.")
+        if len(_worker_templates) >= 8:
+            _worker_templates.clear()
+        _worker_templates[version] = template
+    return render_template(template, context)
+
+
+def read_rows(data, filename=""):
+    """
+    Variable sets from an uploaded CSV (header row = variable names) or JSON array
+    of objects. Raises ValueError when the file can't be read.
+    """
+    if filename.lower().endswith(".json"):
+        try:
+            rows = json.loads(data.decode("utf-8-sig"))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"Invalid JSON: {e}") from e
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("JSON must be an array of objects")
+        return rows
+    try:
+        # utf-8-sig: spreadsheets exported from Excel start with a BOM
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        raise ValueError(f"CSV must be UTF-8 encoded: {e}") from e
+    return [{key.strip(): value for key, value in row.items() if key} for row in csv.DictReader(io.StringIO(text))]
+
+
+def entry_name(index, row, name_field, template_filename):
+    """
+    File name of one contract in the ZIP: the row's name_field value if given, else a row number.
+    """
+    stem = os.path.splitext(os.path.basename(template_filename))[0]
+    label = str(row.get(name_field, "")).strip() if name_field else ""
+    # Keep letters (including Vietnamese), digits, dashes and underscores
+    label = re.sub(r"[^\w\-]+", "_", label).strip("_")[:80]
+    return f"{index + 1:04d}_{label or stem}.docx"
+
+
+async def render_rows(template_path, version, rows, max_in_flight=None):
+    """
+    Render every row with the template in worker processes, yielding
+    (index, row, docx bytes or the exception) in input order. Tasks carry only
+    the template's cache path and version (workers read the bytes once). At most
+    max_in_flight renders are pending at once, so memory stays flat however
+    many rows there are.
+    """
+    pool = get_pool()
+    max_in_flight = max_in_flight or BULK_RENDER_WORKERS * 2
+    loop = asyncio.get_running_loop()
+    pending = deque()
+
+    def submit(row):
+        nonlocal pool
+        try:
+            return loop.run_in_executor(pool, _render_row, template_path, version, row)
+        except BrokenProcessPool:
+            pool = reset_pool(pool)
+            return loop.run_in_executor(pool, _render_row, template_path, version, row)
+
+    async def next_result():
+        nonlocal pool
+        index, row, future = pending.popleft()
+        try:
+            return index, row, await future
+        except BrokenProcessPool as e:
+            pool = reset_pool(pool)
+            return index, row, e
+        except Exception as e:
+            return index, row, e
+
+    try:
+        for index, row in enumerate(rows):
+            pending.append((index, row, submit(row)))
+            if len(pending) >= max_in_flight:
+                yield await next_result()
+        while pending:
+            yield await next_result()
+    finally:
+        # Client gone: don't render the rest
+        for _, _, future in pending:
+            future.cancel()
+
+
+class _ZipBuffer:
+    """
+    Write-only file object collecting what ZipFile writes until it is drained.
+    Without tell()/seek(), ZipFile writes a streamable archive.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+async def stream_zip(results, name_field, template_filename):
+    """
+    ZIP archive of the rendered contracts, yielded piece by piece as they are
+    rendered. Rows that failed are listed in _errors.csv at the end.
+    """
+    buffer = _ZipBuffer()
+    errors = []
+    # .docx files are already compressed
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        async for index, row, result in results:
+            if isinstance(result, Exception):
+                errors.append((index + 1, str(result)))
+                continue
+            archive.writestr(entry_name(index, row, name_field, template_filename), result)
+            yield buffer.drain()
+        if errors:
+            report = io.StringIO()
+            writer = csv.writer(report)
+            writer.writerow(["row", "error"])
+            writer.writerows(errors)
+            archive.writestr("_errors.csv", report.getvalue().encode("utf-8-sig"))
+    yield buffer.drain()
@@ -1,18 +1,23 @@
-import google.generativeai as genai
 import os
 import json
+import asyncio
+from gemini_pool import gemini_pool
+
+# Upper bound on Gemini calls in flight per worker process
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 16))
+_llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+
+GEMINI_ERROR_MESSAGE = "Xin lỗi, đã xảy ra lỗi khi gọi API Gemini"
 
 
 class GeminiBot:
-    def __init__(self, api_key):
+    def __init__(self, api_key, pool=None):
         self.api_key = api_key
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel("gemini-2.5-flash")
+        self.pool = pool or gemini_pool
+        # Set when a Gemini call failed; the error text is still returned/yielded as the answer
+        self.error = None
 
-    def generate_response(self, query, context_chunks):
-        """
-        Generate a response using Gemini based on the query and retrieved context.
-        """
+    def _build_prompt(self, query, context_chunks):
         # Ghi log cấu trúc của context_chunks
 
         # Sử dụng thuộc tính page_content thay vì text
@@ -29,9 +34,17 @@ class GeminiBot:
         Câu hỏi: {query}
 
         Trả lời:"""
+        return system_prompt
+
+    def generate_response(self, query, context_chunks):
+        """
+        Generate a response using Gemini based on the query and retrieved context.
+        """
+        system_prompt = self._build_prompt(query, context_chunks)
 
         try:
-            response = self.model.generate_content(system_prompt)
+            with self.pool.use(self.api_key) as model:
+                response = model.generate_content(system_prompt)
 
             # Ghi log nội dung của response.text
             # print("Raw response from Gemini API:", response.text)
@@ -49,9 +62,48 @@ class GeminiBot:
             # Nếu không phải hợp đồng, trả về văn bản
             return response.text
         except Exception as e:
-            return json.dumps({"response": f"Xin lỗi, đã xảy ra lỗi khi gọi API Gemini: {str(e)}"}, ensure_ascii=False)
+            self.error = e
+            return json.dumps({"response": f"{GEMINI_ERROR_MESSAGE}: {str(e)}"}, ensure_ascii=False)
+
+    async def agenerate_response(self, query, context_chunks):
+        """
+        Async version of generate_response, bounded by LLM_CONCURRENCY.
+        """
+        system_prompt = self._build_prompt(query, context_chunks)
+
+        try:
+            async with _llm_semaphore:
+                with self.pool.use(self.api_key) as model:
+                    response = await model.generate_content_async(system_prompt)
+            return response.text
+        except Exception as e:
+            self.error = e
+            return json.dumps({"response": f"{GEMINI_ERROR_MESSAGE}: {str(e)}"}, ensure_ascii=False)
+
+
+    async def astream_response(self, query, context_chunks):
+        """
+        Stream the answer as Gemini produces it, yielding text fragments.
+        """
+        system_prompt = self._build_prompt(query, context_chunks)
+
+        try:
+            async with _llm_semaphore:
+                with self.pool.use(self.api_key) as model:
+                    response = await model.generate_content_async(system_prompt, stream=True)
+                    async for chunk in response:
+                        try:
+                            text = chunk.text
+                        except ValueError:
+                            # Chunk without text parts (e.g. only finish/safety info)
+                            continue
+                        if text:
+                            yield text
+        except Exception as e:
+            self.error = e
+            yield f"{GEMINI_ERROR_MESSAGE}: {str(e)}"
         
-    def generate_response_contract(self, query, variables, messages=[], contentTemplate=""):
+    def _build_contract_prompt(self, query, variables, messages=[], contentTemplate=""):
         system_prompt = f"""
         Bạn là trợ lý pháp luật AI. Hãy điền các biến hợp đồng dựa trên thông tin người dùng cung cấp.
         Bạn có thể xem lại các tin nhắn trước đó để hiểu ngữ cảnh.
@@ -93,9 +145,29 @@ class GeminiBot:
 
         Trả lời JSON:
         """
+        return system_prompt
+
+    def generate_response_contract(self, query, variables, messages=[], contentTemplate=""):
+        system_prompt = self._build_contract_prompt(query, variables, messages, contentTemplate)
+
+        try:
+            with self.pool.use(self.api_key) as model:
+                response = model.generate_content(system_prompt)
+            return response.text.strip()
+
+        except Exception as e:
+            return json.dumps({
+                "response": f"Lỗi Gemini: {str(e)}",
+                "variables": variables
+            }, ensure_ascii=False)
+
+    async def agenerate_response_contract(self, query, variables, messages=[], contentTemplate=""):
+        system_prompt = self._build_contract_prompt(query, variables, messages, contentTemplate)
 
         try:
-            response = self.model.generate_content(system_prompt)
+            async with _llm_semaphore:
+                with self.pool.use(self.api_key) as model:
+                    response = await model.generate_content_async(system_prompt)
             return response.text.strip()
 
         except Exception as e:
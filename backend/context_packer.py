@@ -0,0 +1,148 @@
+import numpy as np
+from langchain_core.documents import Document
+
+# Rough token estimate for Vietnamese text with Gemini's tokenizer
+CHARS_PER_TOKEN = 3
+# Shortest overlap (in characters) treated as the same text repeated in two chunks
+MIN_OVERLAP = 50
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _overlap_merge(first, second):
+    """
+    Return first + second without their shared text, or None if they don't overlap.
+    """
+    if second in first:
+        return first
+    if first in second:
+        return second
+    head = second[:MIN_OVERLAP]
+    if len(head) < MIN_OVERLAP:
+        return None
+    position = first.find(head)
+    while position >= 0:
+        tail = first[position:]
+        if second.startswith(tail):
+            return first + second[len(tail):]
+        position = first.find(head, position + 1)
+    return None
+
+
+def merge_overlapping(texts):
+    """
+    Join texts in order, dropping text repeated by overlapping neighbours.
+    """
+    merged = ""
+    for text in texts:
+        merged = (_overlap_merge(merged, text) or f"{merged}\n\n{text}") if merged else text
+    return merged
+
+
+class ContextPacker:
+    """
+    Post-retrieval stage between retrieve and generate:
+
+    1. merge overlapping chunks of the same source/page into one passage,
+    2. rerank passages with maximal marginal relevance (relevance minus
+       similarity to passages already picked), so near-duplicates don't crowd
+       out other articles. Relevance is the retrieval rank (fused dense + BM25),
+       so exact citation hits keep their place at the top,
+    3. keep the best passages that fit in token_budget.
+
+    Returned Documents are new objects; the retrieved (possibly cached) ones are
+    never modified.
+    """
+
+    def __init__(self, token_budget=2500, mmr_lambda=0.7):
+        self.token_budget = token_budget
+        self.mmr_lambda = mmr_lambda
+
+    def merge(self, documents):
+        """
+        Merge overlapping chunks of the same source/page. Returns [(Document, [positions])],
+        positions being the indexes of the merged chunks in the input list. Passages
+        list their chunks in metadata["chunk_ids"], so citations can be stored by reference.
+        """
+        passages = []
+        for position, doc in enumerate(documents):
+            key = (doc.metadata.get("source"), doc.metadata.get("page"))
+            for passage in passages:
+                if passage["key"] != key:
+                    continue
+                merged = _overlap_merge(passage["text"], doc.page_content)
+                if merged is None:
+                    merged = _overlap_merge(doc.page_content, passage["text"])
+                if merged is not None:
+                    passage["text"] = merged
+                    passage["positions"].append(position)
+                    break
+            else:
+                passages.append({"key": key, "text": doc.page_content, "doc": doc, "positions": [position]})
+
+        merged = []
+        for passage in passages:
+            metadata = dict(passage["doc"].metadata)
+            chunk_ids = [documents[i].metadata.get("chunk_id") or documents[i].id for i in passage["positions"]]
+            metadata["chunk_ids"] = [chunk_id for chunk_id in chunk_ids if chunk_id]
+            merged.append((Document(page_content=passage["text"], metadata=metadata), passage["positions"]))
+        return merged
+
+    def rerank(self, passages, vectors, total):
+        """
+        Order passages by maximal marginal relevance. A passage's relevance is the
+        rank of its best chunk among the total retrieved ones, scaled to (0, 1].
+        vectors holds one embedding per input chunk (a merged passage uses the
+        mean of its chunks) and only measures redundancy between passages.
+        """
+        if len(passages) < 2:
+            return [doc for doc, _ in passages]
+
+        matrix = np.asarray([np.mean([vectors[i] for i in positions], axis=0) for _, positions in passages], dtype="float32")
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+        relevance = np.asarray([1 - min(positions) / total for _, positions in passages], dtype="float32")
+        similarity = matrix @ matrix.T
+        remaining = list(range(len(passages)))
+        selected = []
+        while remaining:
+            if selected:
+                redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype="float32")
+            scores = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+            selected.append(remaining.pop(int(np.argmax(scores))))
+        return [passages[i][0] for i in selected]
+
+    def pack(self, documents):
+        """
+        Keep passages in order while they fit in the token budget. The first passage
+        is always kept (cut to the budget if needed) so the answer has some context.
+        """
+        packed, used = [], 0
+        for doc in documents:
+            tokens = estimate_tokens(doc.page_content)
+            if used + tokens <= self.token_budget:
+                packed.append(doc)
+                used += tokens
+            elif not packed:
+                text = doc.page_content[: self.token_budget * CHARS_PER_TOKEN]
+                packed.append(Document(page_content=text, metadata=dict(doc.metadata)))
+                used = estimate_tokens(text)
+        return packed
+
+    def run(self, documents, query_embedding=None, get_vectors=None):
+        """
+        Merge, rerank and pack retrieved chunks, given in retrieval order.
+        get_vectors(documents) returns one embedding per chunk; without it (or a
+        query embedding, as for citation lookups) retrieval order is kept.
+        """
+        if not documents:
+            return []
+        passages = self.merge(documents)
+        vectors = get_vectors(documents) if get_vectors and query_embedding is not None else None
+        if vectors is None:
+            return self.pack([doc for doc, _ in passages])
+        return self.pack(self.rerank(passages, vectors, len(documents)))
@@ -0,0 +1,71 @@
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+# Indexes backing every query the API runs, per collection
+INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email"),
+        IndexModel([("verification_token", ASCENDING)], name="verification_token"),
+        IndexModel([("reset_token", ASCENDING)], name="reset_token"),
+    ],
+    "conversations": [
+        # /history/{session_id}; unique because MessageStore upserts one conversation per key
+        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING)], name="user_session_unique", unique=True),
+        # /history: a user's conversations, newest first (keyset pagination on updated_at, _id)
+        IndexModel(
+            [("user_id", ASCENDING), ("updated_at", DESCENDING), ("_id", DESCENDING)],
+            name="user_updated_id",
+        ),
+    ],
+    "messages": [
+        # A conversation's messages in order; unique so a sequence number is never reused
+        IndexModel(
+            [("user_id", ASCENDING), ("session_id", ASCENDING), ("seq", ASCENDING)],
+            name="user_session_seq_unique",
+            unique=True,
+        ),
+    ],
+    "files": [
+        # /admin/upload upserts one record per file name
+        IndexModel([("filename", ASCENDING)], name="filename_unique", unique=True),
+    ],
+    "contracts": [
+        # /download-template reads a template's stored variables by file name
+        IndexModel([("filename", ASCENDING)], name="filename"),
+    ],
+    "ingest_jobs": [
+        # Jobs left running by a previous process are marked interrupted at startup
+        IndexModel([("status", ASCENDING)], name="status"),
+    ],
+}
+
+# Indexes replaced by one above on the same keys: {collection: {new name: old name}}
+REPLACED_INDEXES = {
+    "conversations": {"user_session_unique": "user_session"},
+}
+
+
+async def ensure_indexes(db):
+    """
+    Create missing indexes at startup. Existing ones are left untouched, except
+    those REPLACED_INDEXES swaps for a new definition.
+    A failing index, e.g. unique on data that has duplicates, is reported and skipped.
+    """
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        for index in indexes:
+            name = index.document["name"]
+            old_name = REPLACED_INDEXES.get(collection_name, {}).get(name)
+            if old_name in existing and name not in existing:
+                # Same keys can't be indexed twice: swap the old index for the new one,
+                # restoring it if the new one can't be built
+                await collection.drop_index(old_name)
+            try:
+                await collection.create_indexes([index])
+            except OperationFailure as e:
+                print(f"Could not create index {name} on {collection_name}: {e}")
+                if old_name in existing and name not in existing:
+                    await collection.create_index(existing[old_name]["key"], name=old_name)
+    print("MongoDB indexes ensured.")
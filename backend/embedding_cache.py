@@ -0,0 +1,87 @@
+import array
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+
+def content_hash(text):
+    """
+    Stable hash of a chunk's text (NFC-normalized), used for chunk ids and the embedding cache.
+    """
+    return hashlib.sha256(unicodedata.normalize("NFC", text).encode("utf-8")).hexdigest()
+
+
+def source_prefix(source):
+    """
+    Id prefix shared by every chunk of a source file; ids must be ASCII, file names may not be.
+    """
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()[:16] + "#"
+
+
+def chunk_id(source, text, page=None):
+    """
+    Id of a chunk: its source, page and text. The page is part of it so unchanged text
+    that moved to another page is re-indexed with the new page in its metadata.
+    """
+    location = "" if page is None else str(page)
+    return source_prefix(source) + content_hash(f"{location}\x00{text}")[:32]
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache in SQLite, keyed by (model name, content hash).
+    Shared by every index built with the same model, so a rebuild only embeds new text.
+    """
+
+    def __init__(self, path, model_name):
+        self.path = path
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, hash))"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, hashes):
+        """
+        Return {hash: vector} for the hashes that are cached.
+        """
+        hashes = list(set(hashes))
+        found = {}
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                part = hashes[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(part))})",
+                    [self.model_name, *part],
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array.array("f", blob).tolist()
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, items):
+        """
+        Store {hash: vector}.
+        """
+        rows = [(self.model_name, key, array.array("f", vector).tobytes()) for key, vector in items.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,54 @@
+import time
+import threading
+
+
+class EmbeddingRegistry:
+    """
+    Process-wide registry of embedding models, keyed by name.
+
+    Each model is loaded once, on first use, and shared by every RAGSystem, so
+    rebuilding a RAGSystem (e.g. after /admin/config) never reloads the weights.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._load_seconds = {}
+        self._warm = set()
+        self._lock = threading.Lock()
+
+    def get(self, name, factory):
+        """
+        Return the model registered under name, creating it with factory() the first time.
+        """
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            # Another thread may have loaded it while we waited
+            model = self._models.get(name)
+            if model is None:
+                started = time.perf_counter()
+                model = factory()
+                self._load_seconds[name] = round(time.perf_counter() - started, 2)
+                self._models[name] = model
+                print(f"Loaded embedding model {name} in {self._load_seconds[name]}s")
+        return model
+
+    def warm_up(self, name, factory, text="khởi động"):
+        """
+        Load the model and run one encode, so the first user query doesn't pay for lazy initialisation.
+        """
+        model = self.get(name, factory)
+        if name not in self._warm:
+            model.embed_query(text)
+            self._warm.add(name)
+        return model
+
+    def stats(self):
+        return {
+            name: {"load_seconds": self._load_seconds.get(name), "warm": name in self._warm}
+            for name in self._models
+        }
+
+
+registry = EmbeddingRegistry()
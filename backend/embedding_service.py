@@ -0,0 +1,104 @@
+import time
+import asyncio
+from collections import Counter
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batching front for an embedding model.
+
+    Concurrent embed() calls are queued; a dispatcher takes the first waiting
+    text, keeps collecting for up to max_wait_ms (or until max_batch_size texts),
+    encodes the whole batch with one embed_documents call in a worker thread and
+    resolves each caller's future. At most `concurrency` batches run at once, so
+    under load batches grow instead of requests piling up behind single encodes.
+    """
+
+    def __init__(self, embed_documents, max_batch_size=32, max_wait_ms=5, concurrency=2):
+        self.embed_documents = embed_documents
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.concurrency = concurrency
+        self._loop = None
+        self._dispatcher = None
+        self._running = set()
+
+        self.requests = 0
+        self.batches = 0
+        self.batch_sizes = Counter()
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+        self.encode_seconds = 0.0
+
+    async def embed(self, text):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Queue and semaphore belong to the loop that first uses them
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._dispatcher = None
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        future = loop.create_future()
+        await self._queue.put((text, future, time.perf_counter()))
+        return await future
+
+    async def _dispatch(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Wait for a free encode slot before collecting the next batch,
+            # so requests keep accumulating while the model is busy
+            await self._semaphore.acquire()
+            task = asyncio.create_task(self._run(batch))
+            # Keep a reference so the task isn't garbage collected mid-batch
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        try:
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                wait = started - enqueued
+                self.total_wait += wait
+                self.max_wait_seen = max(self.max_wait_seen, wait)
+            self.requests += len(batch)
+            self.batches += 1
+            self.batch_sizes[len(batch)] += 1
+
+            texts = [text for text, _, _ in batch]
+            try:
+                vectors = await asyncio.to_thread(self.embed_documents, texts)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            self.encode_seconds += time.perf_counter() - started
+            for (_, future, _), vector in zip(batch, vectors):
+                # The caller may have been cancelled (client disconnected)
+                if not future.done():
+                    future.set_result(vector)
+        finally:
+            self._semaphore.release()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "avg_queue_wait_ms": round(self.total_wait / self.requests * 1000, 2) if self.requests else 0.0,
+            "max_queue_wait_ms": round(self.max_wait_seen * 1000, 2),
+            "avg_encode_ms": round(self.encode_seconds / self.batches * 1000, 2) if self.batches else 0.0,
+            "queued": self._queue.qsize() if self._loop else 0,
+        }
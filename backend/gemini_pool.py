@@ -0,0 +1,113 @@
+import os
+import asyncio
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+import google.generativeai as genai
+import google.ai.generativelanguage as glm
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# Distinct API keys (system key + users' own keys) with a live client
+GEMINI_POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", 64))
+
+
+def key_fingerprint(api_key):
+    """
+    Short, non-reversible label for an API key (for stats and logs).
+    """
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class GeminiClientPool:
+    """
+    Gemini models keyed by API key, each with its own sync and async API clients.
+
+    The clients are built with the key in their own client options instead of
+    genai.configure(), which sets one process-wide key: concurrent requests with
+    different keys never see each other's key, and each key reuses its clients'
+    connections across requests. Up to max_clients keys are kept; beyond that the
+    least recently used key without requests in flight is evicted.
+    """
+
+    def __init__(self, max_clients=GEMINI_POOL_SIZE, model_name=GEMINI_MODEL):
+        self.max_clients = max_clients
+        self.model_name = model_name
+        self._models = OrderedDict()
+        self._in_flight = Counter()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    def _create(self, api_key):
+        model = genai.GenerativeModel(self.model_name)
+        # GenerativeModel has no public way to pass clients: it only falls back to the
+        # global (configure()) clients when these are unset. Checked against the pinned
+        # google-generativeai version (requirements.txt); fail loudly if they go away.
+        if not hasattr(model, "_client") or not hasattr(model, "_async_client"):
+            raise RuntimeError(
+                f"google-generativeai {genai.__version__} no longer exposes GenerativeModel._client/_async_client"
+            )
+        model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        model._async_client = glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+        return model
+
+    @contextmanager
+    def use(self, api_key):
+        """
+        The model for api_key (created on first use), pinned for the whole block:
+        the in-flight count is taken under the same lock as the lookup, so the
+        model can't be evicted and closed while it is being used.
+        """
+        with self._lock:
+            model = self._models.get(api_key)
+            if model is not None:
+                self._models.move_to_end(api_key)
+                self.reused += 1
+            else:
+                model = self._create(api_key)
+                self._models[api_key] = model
+                self.created += 1
+            self._in_flight[api_key] += 1
+            self._evict()
+        try:
+            yield model
+        finally:
+            with self._lock:
+                self._in_flight[api_key] -= 1
+                if not self._in_flight[api_key]:
+                    del self._in_flight[api_key]
+                self._evict()
+
+    def _evict(self):
+        idle = [key for key in self._models if not self._in_flight[key]]
+        for key in idle[: max(0, len(self._models) - self.max_clients)]:
+            self._close(self._models.pop(key))
+            self.evicted += 1
+
+    def _close(self, model):
+        # Close the connections now instead of whenever the clients are garbage collected
+        try:
+            model._client.transport.close()
+        except Exception:
+            pass
+        try:
+            asyncio.get_running_loop().create_task(model._async_client.transport.close())
+        except Exception:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._models),
+                "max_clients": self.max_clients,
+                "created": self.created,
+                "reused": self.reused,
+                "evicted": self.evicted,
+                "in_flight": {key_fingerprint(key): count for key, count in self._in_flight.items()},
+            }
+
+
+# Shared by every GeminiBot in this process
+gemini_pool = GeminiClientPool()
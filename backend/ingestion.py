@@ -0,0 +1,225 @@
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import tempfile
+from datetime import datetime
+from pymongo import ReturnDocument
+
+# Per-file states recorded in the job document and in db.files
+QUEUED = "queued"
+PARSING = "parsing"
+EMBEDDING = "embedding"
+INDEXED = "indexed"
+FAILED = "failed"
+
+INTERRUPTED_ERROR = "Interrupted by a server restart, please upload the file again"
+
+# Minimum seconds between progress writes to Mongo for one file
+PROGRESS_INTERVAL = 1.0
+
+
+class StoredUpload:
+    """
+    An uploaded file saved to disk, in the shape RAGSystem.iter_documents expects.
+    """
+
+    def __init__(self, path, name):
+        self.name = name
+        self.path = path
+
+    def getbuffer(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+class IngestionWorkerPool:
+    """
+    Background workers that index uploaded files and record per-file progress in Mongo.
+
+    Each file of a job is queued separately, so several files (from one or
+    several jobs) are parsed, embedded and upserted concurrently.
+    """
+
+    def __init__(self, jobs_collection, files_collection, get_rag_system, workers=2, upload_dir=None):
+        self.jobs = jobs_collection
+        self.files = files_collection
+        self.get_rag_system = get_rag_system
+        self.workers = workers
+        self.upload_dir = upload_dir or os.path.join(tempfile.gettempdir(), "legal_chatbot_uploads")
+        self._queue = asyncio.Queue()
+        self._tasks = []
+
+    async def start(self):
+        os.makedirs(self.upload_dir, exist_ok=True)
+        # Jobs that were running when the previous process stopped will never finish
+        # (their queue was in memory), and neither will their unfinished files
+        now = datetime.utcnow()
+        unfinished = {"$in": [QUEUED, PARSING, EMBEDDING]}
+        await self.jobs.update_many(
+            {"status": {"$in": [QUEUED, "running"]}},
+            {
+                "$set": {
+                    "status": "interrupted",
+                    "updated_at": now,
+                    "files.$[file].status": FAILED,
+                    "files.$[file].error": INTERRUPTED_ERROR,
+                }
+            },
+            array_filters=[{"file.status": unfinished}],
+        )
+        await self.files.update_many(
+            {"status": unfinished},
+            {"$set": {"status": FAILED, "error": INTERRUPTED_ERROR}},
+        )
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def save_upload(self, upload):
+        """
+        Stream a FastAPI UploadFile to the upload directory. Returns (path, size).
+        """
+        path = os.path.join(self.upload_dir, f"{uuid.uuid4().hex}_{os.path.basename(upload.filename)}")
+
+        def copy():
+            with open(path, "wb") as out:
+                shutil.copyfileobj(upload.file, out, 1024 * 1024)
+            return os.path.getsize(path)
+
+        return path, await asyncio.to_thread(copy)
+
+    async def submit(self, uploads, username):
+        """
+        Create a job for [(filename, path, size), ...] and queue its files. Returns the job id.
+        """
+        job_id = uuid.uuid4().hex
+        now = datetime.utcnow()
+        await self.jobs.insert_one(
+            {
+                "_id": job_id,
+                "status": QUEUED,
+                "created_by": username,
+                "created_at": now,
+                "updated_at": now,
+                "total_files": len(uploads),
+                "files_done": 0,
+                "files_failed": 0,
+                "files": [
+                    {"filename": filename, "size": size, "status": QUEUED, "progress": {}, "error": None}
+                    for filename, _, size in uploads
+                ],
+            }
+        )
+        for position, (filename, path, size) in enumerate(uploads):
+            await self.files.update_one(
+                {"filename": filename},
+                {
+                    "$set": {
+                        "filename": filename,
+                        "size": size,
+                        "upload_date": now,
+                        "uploaded_by": username,
+                        "status": QUEUED,
+                        "job_id": job_id,
+                    }
+                },
+                upsert=True,
+            )
+            self._queue.put_nowait((job_id, position, filename, path))
+        return job_id
+
+    async def get_job(self, job_id):
+        return await self.jobs.find_one({"_id": job_id})
+
+    async def _worker(self):
+        while True:
+            job_id, position, filename, path = await self._queue.get()
+            try:
+                await self._process(job_id, position, filename, path)
+            except Exception as e:
+                print(f"Ingestion worker error for {filename}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _set_file_state(self, job_id, position, filename, status, progress=None, error=None):
+        update = {
+            f"files.{position}.status": status,
+            "updated_at": datetime.utcnow(),
+        }
+        if progress is not None:
+            update[f"files.{position}.progress"] = progress
+        if error is not None:
+            update[f"files.{position}.error"] = error
+        await self.jobs.update_one({"_id": job_id}, {"$set": update})
+        await self.files.update_one({"filename": filename, "job_id": job_id}, {"$set": {"status": status}})
+
+    async def _process(self, job_id, position, filename, path):
+        await self.jobs.update_one(
+            {"_id": job_id, "status": QUEUED}, {"$set": {"status": "running"}}
+        )
+        await self._set_file_state(job_id, position, filename, PARSING)
+
+        loop = asyncio.get_running_loop()
+        pending = []
+        last_write = [0.0]
+
+        def on_progress(stats):
+            # Called from the ingestion thread after every embedded batch
+            now = time.monotonic()
+            if now - last_write[0] < PROGRESS_INTERVAL:
+                return
+            last_write[0] = now
+            pending.append(
+                asyncio.run_coroutine_threadsafe(
+                    self._set_file_state(job_id, position, filename, EMBEDDING, progress=stats), loop
+                )
+            )
+
+        stats, error = None, None
+        try:
+            rag_system = self.get_rag_system()
+            if not rag_system:
+                raise RuntimeError("RAG System not configured")
+            stats = await asyncio.to_thread(
+                rag_system.create_vector_db,
+                rag_system.iter_documents([StoredUpload(path, filename)]),
+                on_progress,
+            )
+            if not stats:
+                error = "Indexing failed"
+            elif not stats["chunks"]:
+                error = "No documents processed"
+        except Exception as e:
+            error = str(e)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+        # Let queued progress writes land before the final state
+        if pending:
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in pending), return_exceptions=True)
+
+        if error:
+            await self._set_file_state(job_id, position, filename, FAILED, progress=stats, error=error)
+        else:
+            await self._set_file_state(job_id, position, filename, INDEXED, progress=stats)
+
+        job = await self.jobs.find_one_and_update(
+            {"_id": job_id},
+            {"$inc": {"files_failed" if error else "files_done": 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job and job["files_done"] + job["files_failed"] >= job["total_files"]:
+            if not job["files_failed"]:
+                status = "completed"
+            elif not job["files_done"]:
+                status = FAILED
+            else:
+                status = "partial"
+            await self.jobs.update_one({"_id": job_id}, {"$set": {"status": status, "updated_at": datetime.utcnow()}})
@@ -0,0 +1,215 @@
+import re
+import unicodedata
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# Headings of the Vietnamese legal document hierarchy, matched at the start of a line
+PART_RE = re.compile(r"^(?:Phần|PHẦN)\s+(thứ\s+\S+|THỨ\s+\S+|[IVXLCDM]+|\d+)\b")
+CHAPTER_RE = re.compile(r"^(?:Chương|CHƯƠNG)\s+([IVXLCDM]+|\d+)\b")
+SECTION_RE = re.compile(r"^(?:Mục|MỤC)\s+(\d+)\b")
+ARTICLE_RE = re.compile(r"^(?:Điều|ĐIỀU)\s+(\d+[a-zđ]?)\s*[.:]")
+CLAUSE_RE = re.compile(r"^(\d+)\.\s+\S")
+POINT_RE = re.compile(r"^([a-zđ])\)\s")
+
+
+class VietnameseLegalTextSplitter:
+    """
+    Split Vietnamese statutes along Phần/Chương/Mục/Điều/Khoản/Điểm.
+
+    Each article (Điều) becomes one chunk. Articles longer than chunk_size are split
+    into clauses (Khoản), then points (Điểm), and consecutive pieces are packed back
+    into chunks headed by the article title; only pieces still too long are cut with a
+    character splitter using chunk_overlap. Chunks carry their hierarchy as metadata
+    ("path", "article", "clause", "point"). Text outside any article (preambles,
+    documents without this structure) falls back to the character splitter.
+
+    Pages are consumed as a stream, so articles spanning page breaks stay whole and
+    only the article being built is held in memory.
+    """
+
+    def __init__(self, chunk_size=2000, chunk_overlap=100):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.fallback = self._character_splitter(chunk_size)
+
+    def _character_splitter(self, size):
+        return RecursiveCharacterTextSplitter(
+            chunk_size=size,
+            chunk_overlap=min(self.chunk_overlap, size // 2),
+            separators=["\n\n", "\n", " ", ""],
+        )
+
+    def split_documents(self, documents):
+        return list(self.iter_split(documents))
+
+    def iter_split(self, documents):
+        state = None
+        for doc in documents:
+            source = doc.metadata.get("source")
+            if state is None or state["source"] != source:
+                if state is not None:
+                    yield from self._flush(state)
+                state = self._new_state(source, doc.metadata)
+
+            state["metadata"] = doc.metadata
+            text = unicodedata.normalize("NFC", doc.page_content)
+            for line in text.splitlines():
+                yield from self._feed_line(state, line.strip())
+
+        if state is not None:
+            yield from self._flush(state)
+
+    @staticmethod
+    def _new_state(source, metadata):
+        return {
+            "source": source,
+            "metadata": metadata,
+            "part": None,
+            "chapter": None,
+            "section": None,
+            "article": None,
+            # Heading line of the current article, and whether its first lines were already flushed
+            "heading": None,
+            "continued": False,
+            "title_for": None,
+            "lines": [],
+            "size": 0,
+            "start_metadata": metadata,
+        }
+
+    def _feed_line(self, state, line):
+        if not line:
+            return
+
+        for regex, level in ((PART_RE, "part"), (CHAPTER_RE, "chapter"), (SECTION_RE, "section")):
+            match = regex.match(line)
+            if match:
+                yield from self._flush(state)
+                state[level] = line.split()[0].capitalize() + " " + match.group(1)
+                state["title_for"] = level
+                # A new part/chapter resets the levels below it
+                if level == "part":
+                    state["chapter"] = state["section"] = None
+                elif level == "chapter":
+                    state["section"] = None
+                return
+
+        # The upper-case line right after a heading is its title, e.g. "Chương III" / "HỢP ĐỒNG LAO ĐỘNG"
+        title_for, state["title_for"] = state["title_for"], None
+        if title_for and line.isupper() and not ARTICLE_RE.match(line):
+            state[title_for] += " - " + line[0] + line[1:].lower()
+            return
+
+        match = ARTICLE_RE.match(line)
+        if match:
+            yield from self._flush(state)
+            state["article"] = "Điều " + match.group(1)
+            state["heading"], state["continued"] = line, False
+
+        if not state["lines"]:
+            state["start_metadata"] = state["metadata"]
+        state["lines"].append(line)
+        state["size"] += len(line) + 1
+
+        # Bound memory for text that never reaches another heading
+        if state["size"] > self.chunk_size * 20:
+            yield from self._flush(state, keep_article=True)
+
+    def _flush(self, state, keep_article=False):
+        lines, article, heading, continued = state["lines"], state["article"], state["heading"], state["continued"]
+        state["lines"], state["size"] = [], 0
+        if keep_article:
+            # The rest of the article arrives without its heading line
+            state["continued"] = bool(lines) or continued
+        else:
+            state["article"], state["heading"], state["continued"] = None, None, False
+        if not lines:
+            return
+
+        base = {key: value for key, value in state["start_metadata"].items() if value is not None}
+        hierarchy = [state[level] for level in ("part", "chapter", "section") if state[level]]
+
+        if not article:
+            for piece in self.fallback.split_text("\n".join(lines)):
+                yield self._document(piece, base, hierarchy)
+            return
+
+        # A continuation (after a 20 x chunk_size flush) gets the article heading back
+        body = lines if continued else lines[1:]
+        text = "\n".join([heading] + body)
+        if len(text) <= self.chunk_size:
+            yield self._document(text, base, hierarchy + [article], article=article)
+            return
+
+        # Oversized article: break it into clauses (and points of oversized clauses),
+        # then pack consecutive pieces into chunks prefixed with the article heading.
+        # A heading line that also carries body text is shortened in the prefix and kept whole in the body.
+        if len(heading) > self.chunk_size // 4:
+            if not continued:
+                body = lines
+            heading = heading[: self.chunk_size // 4].rstrip() + "…"
+        room = self.chunk_size - len(heading) - 1
+        splitter = self._character_splitter(room)
+        units = []
+        for clause, clause_lines in self._group(body, CLAUSE_RE):
+            clause_text = "\n".join(clause_lines)
+            if len(clause_text) <= room:
+                units.append((clause, None, clause_text))
+                continue
+            for point, point_lines in self._group(clause_lines, POINT_RE):
+                point_text = "\n".join(point_lines)
+                pieces = [point_text] if len(point_text) <= room else splitter.split_text(point_text)
+                units.extend((clause, point, piece) for piece in pieces)
+
+        packed, size = [], 0
+        for unit in units:
+            if packed and size + len(unit[2]) + 1 > room:
+                yield self._packed_document(heading, packed, base, hierarchy, article)
+                packed, size = [], 0
+            packed.append(unit)
+            size += len(unit[2]) + 1
+        if packed:
+            yield self._packed_document(heading, packed, base, hierarchy, article)
+
+    def _packed_document(self, heading, units, base, hierarchy, article):
+        clauses = [clause for clause, _, _ in units if clause]
+        points = {point for _, point, _ in units}
+        clause = None
+        if clauses:
+            clause = clauses[0] if clauses[0] == clauses[-1] else f"{clauses[0]}-{clauses[-1]}"
+        point = units[0][1] if len(points) == 1 and clause and "-" not in clause else None
+
+        path = hierarchy + [article]
+        if clause:
+            path.append(f"Khoản {clause}")
+        if point:
+            path.append(f"Điểm {point}")
+        text = "\n".join([heading] + [unit[2] for unit in units])
+        return self._document(text, base, path, article=article, clause=clause, point=point)
+
+    @staticmethod
+    def _group(lines, regex):
+        """
+        Group lines into (label, lines) runs, starting a new run at every regex match.
+        """
+        label, current = None, []
+        for line in lines:
+            match = regex.match(line)
+            if match and current:
+                yield label, current
+                current = []
+            if match:
+                label = match.group(1)
+            current.append(line)
+        if current:
+            yield label, current
+
+    @staticmethod
+    def _document(text, base, path, article=None, clause=None, point=None):
+        metadata = dict(base)
+        if path:
+            metadata["path"] = " > ".join(path)
+        for key, value in (("article", article), ("clause", clause), ("point", point)):
+            if value:
+                metadata[key] = value
+        return Document(page_content=text, metadata=metadata)
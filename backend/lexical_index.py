@@ -0,0 +1,288 @@
+import os
+import re
+import json
+import math
+import mmap
+import threading
+import unicodedata
+from collections import Counter
+import numpy as np
+from langchain_core.documents import Document
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+
+# Metadata indexed along with the chunk text, so "Chương III" or a file name also match
+INDEXED_FIELDS = ("source", "path")
+
+
+def tokenize(text):
+    """
+    Vietnamese-aware tokens: lower-cased NFC syllables plus adjacent-syllable bigrams
+    (most Vietnamese words are two syllables, e.g. "lao_động", "nđ_cp").
+    """
+    syllables = TOKEN_RE.findall(unicodedata.normalize("NFC", text or "").lower())
+    return syllables + [f"{a}_{b}" for a, b in zip(syllables, syllables[1:])]
+
+
+class BM25Index:
+    """
+    Sparse BM25 index over chunk texts, kept next to the vector store.
+
+    Saved postings use a compact CSR layout: vocab.json maps each term to a slice of
+    postings_docs.npy (uint32 doc numbers) and postings_tfs.npy (uint16 term
+    frequencies). Saved arrays and the docstore are memory-mapped on load; chunks
+    added afterwards live in in-memory postings until the next save().
+    """
+
+    VOCAB_FILE = "vocab.json"
+    DOCS_FILE = "postings_docs.npy"
+    TFS_FILE = "postings_tfs.npy"
+    LENGTHS_FILE = "doc_lengths.npy"
+    IDS_FILE = "ids.json"
+    DOCSTORE_FILE = "docstore.jsonl"
+    OFFSETS_FILE = "offsets.npy"
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        # Saved (memory-mapped) part
+        self._vocab = {}
+        self._post_docs = np.zeros(0, dtype="uint32")
+        self._post_tfs = np.zeros(0, dtype="uint16")
+        self._base_count = 0
+        self._docstore_file = None
+        self._docstore_mmap = None
+        self._offsets = np.zeros(1, dtype="int64")
+        # Added since the last save
+        self._delta = {}
+        self._new_docs = {}
+        self._new_lengths = []
+        # Whole index
+        self._lengths = np.zeros(0, dtype="uint32")
+        self._ids = []
+        self._id_to_doc = {}
+        self._deleted = set()
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._ids) - len(self._deleted)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self._id_to_doc
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def add_many(self, ids, texts, metadatas):
+        with self._lock:
+            for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                if chunk_id in self._id_to_doc:
+                    self._delete_doc(self._id_to_doc[chunk_id])
+
+                doc = len(self._ids)
+                fields = " ".join(str(metadata.get(field) or "") for field in INDEXED_FIELDS)
+                tokens = tokenize(text + " " + fields)
+                for term, tf in Counter(tokens).items():
+                    self._delta.setdefault(term, []).append((doc, min(tf, 65535)))
+                self._ids.append(chunk_id)
+                self._id_to_doc[chunk_id] = doc
+                self._new_docs[doc] = {"text": text, "metadata": dict(metadata)}
+                self._new_lengths.append(len(tokens))
+                self._total_length += len(tokens)
+
+    def _delete_doc(self, doc):
+        self._id_to_doc.pop(self._ids[doc], None)
+        self._deleted.add(doc)
+        self._total_length -= self._length(doc)
+
+    def _length(self, doc):
+        if doc < self._base_count:
+            return int(self._lengths[doc])
+        return self._new_lengths[doc - self._base_count]
+
+    def delete(self, ids):
+        with self._lock:
+            for chunk_id in ids:
+                if chunk_id in self._id_to_doc:
+                    self._delete_doc(self._id_to_doc[chunk_id])
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            self.delete([chunk_id for chunk_id in self._id_to_doc if chunk_id.startswith(prefix)])
+
+    def delete_all(self):
+        with self._lock:
+            self._close_docstore()
+            self._reset()
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+    def _postings(self, term):
+        docs, tfs = [], []
+        if term in self._vocab:
+            start, length = self._vocab[term]
+            docs.append(np.asarray(self._post_docs[start:start + length], dtype="int64"))
+            tfs.append(np.asarray(self._post_tfs[start:start + length], dtype="float32"))
+        if term in self._delta:
+            delta = np.asarray(self._delta[term], dtype="int64").reshape(-1, 2)
+            docs.append(delta[:, 0])
+            tfs.append(delta[:, 1].astype("float32"))
+        if not docs:
+            return None, None
+        return np.concatenate(docs), np.concatenate(tfs)
+
+    def search_with_score(self, query, k=10):
+        with self._lock:
+            live = len(self)
+            if not live:
+                return []
+            total = len(self._ids)
+            lengths = np.concatenate([np.asarray(self._lengths, dtype="float32"), np.asarray(self._new_lengths, dtype="float32")])
+            avg_length = max(self._total_length / live, 1.0)
+
+            scores = np.zeros(total, dtype="float32")
+            for term in set(tokenize(query)):
+                docs, tfs = self._postings(term)
+                if docs is None:
+                    continue
+                df = len(docs)
+                idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+                norm = tfs + self.k1 * (1 - self.b + self.b * lengths[docs] / avg_length)
+                np.add.at(scores, docs, idf * tfs * (self.k1 + 1) / norm)
+
+            if self._deleted:
+                scores[list(self._deleted)] = 0
+            # Partial selection of the k best matching documents, then sort only those
+            top = np.flatnonzero(scores > 0)
+            if len(top) > k:
+                top = top[np.argpartition(-scores[top], k)[:k]]
+            top = top[np.argsort(-scores[top])]
+            return [(self._get_document(int(doc)), float(scores[doc])) for doc in top]
+
+    def search(self, query, k=10):
+        return [doc for doc, _ in self.search_with_score(query, k)]
+
+    # ------------------------------------------------------------------
+    # Docstore
+    # ------------------------------------------------------------------
+    def _get_record(self, doc):
+        if doc in self._new_docs:
+            return self._new_docs[doc]
+        start, end = int(self._offsets[doc]), int(self._offsets[doc + 1])
+        return json.loads(self._docstore_mmap[start:end].decode("utf-8"))
+
+    def get_texts(self, ids):
+        """
+        Return {chunk_id: text} for the given ids that are in the index.
+        """
+        with self._lock:
+            return {
+                chunk_id: self._get_record(self._id_to_doc[chunk_id])["text"]
+                for chunk_id in ids
+                if chunk_id in self._id_to_doc
+            }
+
+    def _get_document(self, doc):
+        record = self._get_record(doc)
+        return Document(id=self._ids[doc], page_content=record["text"], metadata=record["metadata"])
+
+    def _close_docstore(self):
+        if self._docstore_mmap is not None:
+            self._docstore_mmap.close()
+            self._docstore_mmap = None
+        if self._docstore_file is not None:
+            self._docstore_file.close()
+            self._docstore_file = None
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def save(self, folder_path):
+        """
+        Merge saved and new postings (dropping deleted chunks) into fresh CSR files.
+        """
+        with self._lock:
+            os.makedirs(folder_path, exist_ok=True)
+            total = len(self._ids)
+            keep = [doc for doc in range(total) if doc not in self._deleted]
+            remap = np.full(total, -1, dtype="int64")
+            remap[keep] = np.arange(len(keep))
+
+            def tmp(name):
+                return os.path.join(folder_path, name + ".tmp")
+
+            offsets = [0]
+            with open(tmp(self.DOCSTORE_FILE), "wb") as f:
+                for doc in keep:
+                    line = json.dumps(self._get_record(doc), ensure_ascii=False).encode("utf-8") + b"\n"
+                    f.write(line)
+                    offsets.append(offsets[-1] + len(line))
+
+            vocab, all_docs, all_tfs, position = {}, [], [], 0
+            for term in set(self._vocab) | set(self._delta):
+                docs, tfs = self._postings(term)
+                docs = remap[docs]
+                alive = docs >= 0
+                if not alive.any():
+                    continue
+                docs, tfs = docs[alive], tfs[alive]
+                vocab[term] = [position, len(docs)]
+                position += len(docs)
+                all_docs.append(docs.astype("uint32"))
+                all_tfs.append(tfs.astype("uint16"))
+
+            lengths = np.asarray([self._length(doc) for doc in keep], dtype="uint32")
+            arrays = {
+                self.DOCS_FILE: np.concatenate(all_docs) if all_docs else np.zeros(0, dtype="uint32"),
+                self.TFS_FILE: np.concatenate(all_tfs) if all_tfs else np.zeros(0, dtype="uint16"),
+                self.LENGTHS_FILE: lengths,
+                self.OFFSETS_FILE: np.asarray(offsets, dtype="int64"),
+            }
+            for name, values in arrays.items():
+                with open(tmp(name), "wb") as f:
+                    np.save(f, values)
+            with open(tmp(self.VOCAB_FILE), "w", encoding="utf-8") as f:
+                json.dump(vocab, f, ensure_ascii=False)
+            with open(tmp(self.IDS_FILE), "w", encoding="utf-8") as f:
+                json.dump([self._ids[doc] for doc in keep], f, ensure_ascii=False)
+
+            # Release mmaps on the old files before replacing them (required on Windows)
+            self._close_docstore()
+            self._reset()
+            for name in (self.VOCAB_FILE, self.IDS_FILE, self.DOCSTORE_FILE, *arrays):
+                os.replace(tmp(name), os.path.join(folder_path, name))
+            self._open(folder_path)
+            return True
+
+    def _open(self, folder_path):
+        with open(os.path.join(folder_path, self.VOCAB_FILE), "r", encoding="utf-8") as f:
+            self._vocab = json.load(f)
+        with open(os.path.join(folder_path, self.IDS_FILE), "r", encoding="utf-8") as f:
+            self._ids = json.load(f)
+        self._post_docs = np.load(os.path.join(folder_path, self.DOCS_FILE), mmap_mode="r")
+        self._post_tfs = np.load(os.path.join(folder_path, self.TFS_FILE), mmap_mode="r")
+        self._lengths = np.load(os.path.join(folder_path, self.LENGTHS_FILE))
+        self._offsets = np.load(os.path.join(folder_path, self.OFFSETS_FILE), mmap_mode="r")
+        self._base_count = len(self._ids)
+        self._id_to_doc = {chunk_id: doc for doc, chunk_id in enumerate(self._ids)}
+        self._total_length = int(self._lengths.sum())
+
+        self._docstore_file = open(os.path.join(folder_path, self.DOCSTORE_FILE), "rb")
+        if os.path.getsize(self._docstore_file.name) > 0:
+            self._docstore_mmap = mmap.mmap(self._docstore_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def exists(cls, folder_path):
+        return bool(folder_path) and os.path.exists(os.path.join(folder_path, cls.VOCAB_FILE))
+
+    @classmethod
+    def load(cls, folder_path, **kwargs):
+        index = cls(**kwargs)
+        if cls.exists(folder_path):
+            index._open(folder_path)
+        return index
@@ -1,22 +1,36 @@
 import os
+import time
+import asyncio
 from datetime import datetime, timedelta
 import certifi
-from typing import List
+from urllib.parse import quote
+from typing import List, Optional
 from fastapi import (
     FastAPI,
     UploadFile,
     File,
+    Form,
     HTTPException,
     Body,
     Depends,
+    Query,
+    Response,
     status,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.security import OAuth2PasswordRequestForm
 from motor.motor_asyncio import AsyncIOMotorClient
-from rag_engine import RAGSystem
+from rag_engine import RAGSystem, is_citation_query, warm_up_embeddings
 from chatbot import GeminiBot
+from gemini_pool import gemini_pool
+from answer_cache import SemanticAnswerCache
+from ingestion import IngestionWorkerPool
+from rate_limit import UsageQuota, TokenBucketLimiter, ConcurrencyLimiter, rate_limit, check_rate
+from db_indexes import ensure_indexes
+from message_store import MessageStore, resolve_sources, strip_sources
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
 from auth import (
     create_access_token,
@@ -25,6 +39,9 @@ from auth import (
     ACCESS_TOKEN_EXPIRE_MINUTES,
     oauth2_scheme,
     get_user,
+    get_cached_user,
+    invalidate_user,
+    user_cache,
     SECRET_KEY,
     ALGORITHM,
 )
@@ -45,12 +62,25 @@ from models import (
 from email_utils import send_verification_email, send_password_reset_email
 import secrets
 from jose import JWTError, jwt
-from security import encrypt_key, decrypt_key
-import requests
-import tempfile
-import re
+from security import (
+    encrypt_key,
+    cached_user_key,
+    decrypt_user_key,
+    invalidate_user_key,
+    key_cache_stats,
+)
 import json
-from docxtpl import DocxTemplate
+from template_cache import TemplateCache, parse_template, render_template
+from artifacts import ArtifactStore
+from bulk_contracts import (
+    BULK_MAX_ROWS,
+    read_rows,
+    render_rows,
+    template_version,
+    shutdown_pool,
+    stream_zip,
+)
+from cache import LRUCache
 from supabase import create_client
 
 load_dotenv()
@@ -64,6 +94,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Pagination cursor of GET /history
+    expose_headers=["X-Next-Cursor"],
 )
 
 
@@ -85,43 +117,30 @@ chat_collection = db.chats
 conversations_collection = db.conversations
 users_collection = db.users
 contract_collection = db.contracts
-
-
-def download_template(url, path="template.docx"):
-    r = requests.get(url)
-    r.raise_for_status()
-
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".docx")
-    tmp.write(r.content)
-    tmp.close()
-    doc = DocxTemplate(tmp.name)
-    doc.save("output_template.docx")
-    txt = "\n".join([p.text for p in doc.docx.paragraphs if p.text])
-
-    vars = set(re.findall(r"{{(.*?)}}", txt))
-
-    return {var_name: "" for var_name in vars}, txt
-
-
-def fill_contract(template_path, data, output_path="contract.docx"):
-    """
-    Điền dữ liệu vào template và lưu file kết quả (ghi đè nếu file đã tồn tại).
-
-    Args:
-        template_path (str): Đường dẫn đến file template.
-        data (dict): Dữ liệu để điền vào các trường.
-        output_path (str): Đường dẫn lưu file kết quả (mặc định là 'contract.docx').
-
-    Returns:
-        str: Đường dẫn của file kết quả.
-    """
-    doc = DocxTemplate(template_path)
-    doc.render(data)  # Điền dữ liệu vào template
-    # nếu file đã tồn tai thì xóa đi
-    if os.path.exists(output_path):
-        os.remove(output_path)
-    doc.save(output_path)  # Ghi đè file nếu đã tồn tại
-    return output_path
+# Contract template .docx files, so opening a template needs no download
+template_cache = TemplateCache()
+# Filled contracts waiting to be downloaded, and the template each user opened last
+artifact_store = ArtifactStore()
+opened_templates = LRUCache(maxsize=10000)
+messages_collection = db.messages
+message_store = MessageStore(conversations_collection, messages_collection)
+
+# Daily chat quota per tier, and per-IP burst limits for login/signup
+usage_quota = UsageQuota(users_collection)
+login_limiter = TokenBucketLimiter(
+    rate=float(os.getenv("LOGIN_RATE_PER_MINUTE", 10)) / 60,
+    burst=int(os.getenv("LOGIN_BURST", 5)),
+)
+register_limiter = TokenBucketLimiter(
+    rate=float(os.getenv("REGISTER_RATE_PER_MINUTE", 3)) / 60,
+    burst=int(os.getenv("REGISTER_BURST", 3)),
+)
+# Bulk contract jobs share the render pool: limited per user, in rate and in jobs running at once
+bulk_limiter = TokenBucketLimiter(
+    rate=float(os.getenv("BULK_RATE_PER_MINUTE", 2)) / 60,
+    burst=int(os.getenv("BULK_BURST", 2)),
+)
+bulk_jobs = ConcurrencyLimiter(int(os.getenv("BULK_MAX_JOBS_PER_USER", 1)))
 
 
 @app.on_event("startup")
@@ -129,9 +148,19 @@ async def startup_db_client():
     try:
         await client.admin.command("ping")
         print("Successfully connected to MongoDB!")
+        await ensure_indexes(db)
     except Exception as e:
         print(f"Failed to connect to MongoDB: {e}")
 
+    await ingestion_pool.start()
+    await message_store.start()
+
+    # Load the shared embedding model and run one encode before serving queries
+    try:
+        await asyncio.to_thread(warm_up_embeddings)
+    except Exception as e:
+        print(f"Failed to warm up embedding model: {e}")
+
     # Check Email Config on Startup
     email_from = os.getenv("EMAIL_FROM")
     if email_from:
@@ -140,16 +169,45 @@ async def startup_db_client():
         print("WARNING: EMAIL_FROM is not set. Email sending will fail.")
 
 
+@app.on_event("shutdown")
+async def shutdown_workers():
+    await ingestion_pool.stop()
+    # Persist message pairs still queued by the write-behind store
+    await message_store.stop()
+    shutdown_pool()
+
+
 # Initialize RAG System (System-wide Pinecone)
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "legal-chatbot")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "vector_index")
+
+# Semantic cache of Gemini answers, shared by /chat and /chat/stream
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95)),
+    maxsize=int(os.getenv("ANSWER_CACHE_SIZE", 512)),
+    ttl=int(os.getenv("ANSWER_CACHE_TTL", 3600)),
+)
 
 rag_system = None
-if PINECONE_API_KEY and PINECONE_INDEX_NAME:
-    rag_system = RAGSystem(PINECONE_API_KEY, PINECONE_INDEX_NAME)
+if VECTOR_BACKEND == "local" or (PINECONE_API_KEY and PINECONE_INDEX_NAME):
+    rag_system = RAGSystem(
+        PINECONE_API_KEY, PINECONE_INDEX_NAME, VECTOR_BACKEND, LOCAL_INDEX_PATH
+    )
     rag_system.load_index()
 
 
+# Background ingestion for /admin/upload (reads the current rag_system at run time)
+ingestion_pool = IngestionWorkerPool(
+    db.ingest_jobs,
+    db.files,
+    lambda: rag_system,
+    workers=int(os.getenv("INGEST_WORKERS", 2)),
+    upload_dir=os.getenv("INGEST_UPLOAD_DIR"),
+)
+
+
 # Dependency to get DB
 async def get_db():
     return db
@@ -170,7 +228,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
 
-    user = await get_user(db, username)
+    user = await get_cached_user(db, username)
     if user is None:
         raise credentials_exception
     return user
@@ -192,7 +250,11 @@ async def get_current_admin_user(
     return current_user
 
 
-@app.post("/token", response_model=Token)
+@app.post(
+    "/token",
+    response_model=Token,
+    dependencies=[Depends(rate_limit(login_limiter))],
+)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
 ):
@@ -219,7 +281,11 @@ async def login_for_access_token(
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-@app.post("/register", response_model=User)
+@app.post(
+    "/register",
+    response_model=User,
+    dependencies=[Depends(rate_limit(register_limiter))],
+)
 async def register_user(user: UserCreate):
     existing_user = await get_user(db, user.username)
     if existing_user:
@@ -240,11 +306,18 @@ async def register_user(user: UserCreate):
     )
 
     # First user is admin (optional logic, or manually set in DB)
-    if await db.users.count_documents({}) == 0:
+    # Existence check instead of counting every user
+    if await db.users.find_one({}, {"_id": 1}) is None:
         user_in_db.role = "admin"
         user_in_db.is_verified = True  # Auto verify first admin for convenience
 
-    await db.users.insert_one(user_in_db.dict())
+    try:
+        await db.users.insert_one(user_in_db.dict())
+    except DuplicateKeyError:
+        # Concurrent signup with the same username (unique index)
+        raise HTTPException(
+            status_code=400, detail="Username already registered"
+        )
 
     if not user_in_db.is_verified and user.email:
         # Send verification email
@@ -272,6 +345,7 @@ async def verify_email(token: str):
         {"_id": user["_id"]},
         {"$set": {"is_verified": True, "verification_token": None}},
     )
+    invalidate_user(user["username"])
     return {"message": "Email verified successfully"}
 
 
@@ -289,6 +363,7 @@ async def forgot_password(email: str = Body(..., embed=True)):
         {"_id": user["_id"]},
         {"$set": {"reset_token": reset_token, "reset_token_expiry": expiry}},
     )
+    invalidate_user(user["username"])
 
     send_password_reset_email(email, reset_token)
     return {"message": "If email exists, reset link sent"}
@@ -318,6 +393,7 @@ async def reset_password(token: str = Body(...), new_password: str = Body(...)):
             }
         },
     )
+    invalidate_user(user["username"])
     return {"message": "Password reset successfully"}
 
 
@@ -331,11 +407,13 @@ async def update_gemini_key(
     key: str = Body(..., embed=True),
     current_user: UserInDB = Depends(get_current_active_user),
 ):
-    encrypted_key = encrypt_key(key)
+    encrypted_key = await asyncio.to_thread(encrypt_key, key)
     await db.users.update_one(
         {"username": current_user.username},
         {"$set": {"gemini_api_key": encrypted_key}},
     )
+    invalidate_user_key(current_user.username)
+    invalidate_user(current_user.username)
     return {"status": "success"}
 
 
@@ -348,6 +426,7 @@ async def upgrade_subscription(
         {"username": current_user.username},
         {"$set": {"upgrade_requested": True}},
     )
+    invalidate_user(current_user.username)
     return {
         "status": "success",
         "message": "Yêu cầu nâng cấp đã được gửi. Vui lòng chờ Admin duyệt.",
@@ -370,6 +449,7 @@ async def update_user_subscription(
     result = await users_collection.update_one(
         {"username": username}, {"$set": update_data}
     )
+    invalidate_user(username)
 
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
@@ -380,13 +460,12 @@ async def update_user_subscription(
     }
 
 
-@app.post("/chat")
-async def chat(
-    request: ChatRequest,
-    current_user: UserInDB = Depends(get_current_active_user),
-):
-    global rag_system
-
+async def resolve_gemini_key(current_user: UserInDB):
+    """
+    Pick the Gemini key for a chat request: the user's own key, otherwise the
+    system key for premium users or free users still under the daily limit.
+    The request is counted against the tier's daily quota in one atomic update.
+    """
     # Use user's Gemini Key if available, else system's (if you want to allow that)
     # Prompt says: "User just adds gemini key".
     user_gemini_key = current_user.gemini_api_key
@@ -395,65 +474,110 @@ async def chat(
 
     if user_gemini_key:
         print("User has custom Gemini Key.")
-        final_gemini_key = decrypt_key(user_gemini_key)
-
-    if not final_gemini_key:
-        # Check subscription and limits
-        if current_user.subscription_type == "premium":
-            # Use system key (from env or config)
-            # For now, assuming system key is set in env GOOGLE_API_KEY or similar,
-            # BUT chatbot.py uses the key passed to it.
-            # We need a system-wide key. Let's assume one is in env.
-            final_gemini_key = os.getenv("GOOGLE_API_KEY")
-            if not final_gemini_key:
-                raise HTTPException(
-                    status_code=503, detail="System Gemini Key not configured."
-                )
-        else:
-            # Free user - Check limits
-            today = datetime.utcnow().replace(
-                hour=0, minute=0, second=0, microsecond=0
+        # Decrypted keys are cached per user; decryption only runs on a miss
+        final_gemini_key = cached_user_key(current_user.username, user_gemini_key)
+        if not final_gemini_key:
+            final_gemini_key, rotated_key = await asyncio.to_thread(
+                decrypt_user_key, current_user.username, user_gemini_key
             )
-            last_usage = current_user.last_usage_date
-
-            if last_usage and last_usage >= today:
-                if current_user.daily_usage_count >= 5:
-                    raise HTTPException(
-                        status_code=402,
-                        detail="Daily limit reached. Please upgrade or add your own API Key.",
-                    )
-
-                # Increment
-                await db.users.update_one(
-                    {"username": current_user.username},
-                    {
-                        "$inc": {"daily_usage_count": 1},
-                        "$set": {"last_usage_date": datetime.utcnow()},
-                    },
-                )
-            else:
-                # Reset and increment
+            if rotated_key:
+                # Encrypted with a previous SECRET_KEY: store it under the current one
                 await db.users.update_one(
-                    {"username": current_user.username},
-                    {
-                        "$set": {
-                            "daily_usage_count": 1,
-                            "last_usage_date": datetime.utcnow(),
-                        }
-                    },
+                    {"username": current_user.username, "gemini_api_key": user_gemini_key},
+                    {"$set": {"gemini_api_key": rotated_key}},
                 )
+                invalidate_user(current_user.username)
 
-            final_gemini_key = os.getenv("GOOGLE_API_KEY")
-            if not final_gemini_key:
-                raise HTTPException(
-                    status_code=503, detail="System Gemini Key not configured."
-                )
+    if final_gemini_key:
+        tier = "own_key"
+    else:
+        tier = "premium" if current_user.subscription_type == "premium" else "free"
+        # System-wide key for premium users and free users under the limit
+        final_gemini_key = os.getenv("GOOGLE_API_KEY")
+        if not final_gemini_key:
+            raise HTTPException(
+                status_code=503, detail="System Gemini Key not configured."
+            )
 
-    if not final_gemini_key:
+    usage = await usage_quota.consume(current_user.username, tier)
+    if usage is False:
         raise HTTPException(
-            status_code=400,
-            detail="Please configure your Gemini API Key in settings or upgrade to Premium.",
+            status_code=402,
+            detail="Daily limit reached. Please upgrade or add your own API Key.",
         )
+    if usage is not None:
+        # /users/me shows the counter
+        invalidate_user(current_user.username)
+
+    return final_gemini_key
+
+
+def format_sources(context_chunks):
+    formatted_sources = []
+    for doc in context_chunks:
+        chunk_ids = doc.metadata.get("chunk_ids") or [
+            doc.metadata.get("chunk_id")
+        ]
+        formatted_sources.append(
+            {
+                "content": doc.page_content,
+                "source": doc.metadata.get("source", "Unknown"),
+                "page": doc.metadata.get("page", 0)
+                + 1,  # Convert 0-index to 1-index for display
+                # Saved messages keep only these references, not the text
+                "chunk_ids": [chunk_id for chunk_id in chunk_ids if chunk_id],
+            }
+        )
+    return formatted_sources
+
+
+async def retrieve_context(message: str):
+    """
+    Returns (query_embedding, index_version, cached_answer, context_chunks).
+
+    Citation lookups ("Điều 36 Bộ luật Lao động 2019") are answered from the BM25
+    index without embedding; other queries are embedded once, checked against the
+    answer cache, then retrieved with hybrid (vector + BM25) search. Retrieved chunks
+    are packed into CONTEXT_TOKEN_BUDGET before generation.
+    """
+    index_version = rag_system.index_version
+    if is_citation_query(message):
+        context_chunks = await rag_system.alexical_search(message)
+        if context_chunks:
+            context_chunks = await rag_system.apack_context(context_chunks)
+            return None, index_version, None, context_chunks
+
+    query_embedding = await rag_system.aembed_query(message)
+    cached = answer_cache.lookup(query_embedding, index_version)
+    if cached:
+        return query_embedding, index_version, cached, []
+    context_chunks = await rag_system.ahybrid_search(message, query_embedding)
+    # Merge overlapping chunks, rerank and fit the prompt budget; sources show the packed chunks
+    context_chunks = await rag_system.apack_context(context_chunks, query_embedding)
+    return query_embedding, index_version, None, context_chunks
+
+
+async def save_conversation(session_id: str, username: str, user_msg, bot_msg):
+    """
+    Append a user/assistant message pair to the conversation, creating it if needed.
+    The pair is queued and persisted in the background (see MessageStore).
+    """
+    message_store.append(session_id, username, user_msg, bot_msg)
+
+
+def sse_event(event: str, data) -> str:
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+@app.post("/chat")
+async def chat(
+    request: ChatRequest,
+    current_user: UserInDB = Depends(get_current_active_user),
+):
+    global rag_system
+
+    final_gemini_key = await resolve_gemini_key(current_user)
 
     if not rag_system:
         raise HTTPException(
@@ -461,8 +585,11 @@ async def chat(
             detail="System RAG (Pinecone) not configured by Admin.",
         )
 
-    # Retrieve context
-    context_chunks = rag_system.retrieve(request.message)
+    # Embed once: the vector serves both the answer cache and the vector query
+    # (embedding + index queries run off the event loop)
+    query_embedding, index_version, cached, context_chunks = (
+        await retrieve_context(request.message)
+    )
 
     # if request.isConstract:
     #     try:
@@ -496,11 +623,30 @@ async def chat(
     #         raise HTTPException(status_code=500, detail=f"Error generating contract: {str(e)}")
 
     # Generate response for normal chat mode
-    try:
-        bot = GeminiBot(final_gemini_key)
-        response_text = bot.generate_response(request.message, context_chunks)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Gemini Error: {str(e)}")
+    if cached:
+        response_text = cached["answer"]
+        formatted_sources = cached["sources"]
+    else:
+        try:
+            started = time.perf_counter()
+            bot = GeminiBot(final_gemini_key)
+            response_text = await bot.agenerate_response(
+                request.message, context_chunks
+            )
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Gemini Error: {str(e)}"
+            )
+
+        formatted_sources = format_sources(context_chunks)
+        if query_embedding is not None and bot.error is None:
+            answer_cache.store(
+                query_embedding,
+                index_version,
+                response_text,
+                formatted_sources,
+                time.perf_counter() - started,
+            )
 
     # Create Messages
     user_msg = {
@@ -509,17 +655,6 @@ async def chat(
         "timestamp": datetime.utcnow(),
     }
 
-    formatted_sources = []
-    for doc in context_chunks:
-        formatted_sources.append(
-            {
-                "content": doc.page_content,
-                "source": doc.metadata.get("source", "Unknown"),
-                "page": doc.metadata.get("page", 0)
-                + 1,  # Convert 0-index to 1-index for display
-            }
-        )
-
     bot_msg = {
         "role": "assistant",
         "content": response_text,
@@ -528,35 +663,147 @@ async def chat(
     }
 
     # Update Conversation in MongoDB
-    existing_conv = await conversations_collection.find_one(
-        {"session_id": request.session_id, "user_id": current_user.username}
+    await save_conversation(
+        request.session_id, current_user.username, user_msg, bot_msg
     )
 
-    if existing_conv:
-        await conversations_collection.update_one(
-            {"session_id": request.session_id},
-            {
-                "$push": {"messages": {"$each": [user_msg, bot_msg]}},
-                "$set": {"updated_at": datetime.utcnow()},
-            },
+    return {"response": response_text, "sources": formatted_sources}
+
+
+@app.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    current_user: UserInDB = Depends(get_current_active_user),
+):
+    """
+    Same as /chat but streams the answer over server-sent events:
+    one "sources" event, then "token" events as Gemini produces text,
+    then "done". The message pair is saved once the stream finishes.
+    """
+    global rag_system
+
+    final_gemini_key = await resolve_gemini_key(current_user)
+
+    if not rag_system:
+        raise HTTPException(
+            status_code=503,
+            detail="System RAG (Pinecone) not configured by Admin.",
         )
+
+    query_embedding, index_version, cached, context_chunks = (
+        await retrieve_context(request.message)
+    )
+    if cached:
+        formatted_sources = cached["sources"]
     else:
-        title = (
-            request.message[:50] + "..."
-            if len(request.message) > 50
-            else request.message
-        )
-        new_conv = {
-            "session_id": request.session_id,
-            "user_id": current_user.username,
-            "title": title,
-            "messages": [user_msg, bot_msg],
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow(),
+        formatted_sources = format_sources(context_chunks)
+    bot = GeminiBot(final_gemini_key)
+
+    user_msg = {
+        "role": "user",
+        "content": request.message,
+        "timestamp": datetime.utcnow(),
+    }
+
+    def build_bot_msg(parts):
+        return {
+            "role": "assistant",
+            "content": "".join(parts),
+            "sources": formatted_sources,
+            "timestamp": datetime.utcnow(),
         }
-        await conversations_collection.insert_one(new_conv)
 
-    return {"response": response_text, "sources": formatted_sources}
+    async def event_stream():
+        parts = []
+        yield sse_event("sources", formatted_sources)
+        if cached:
+            parts.append(cached["answer"])
+            yield sse_event("token", {"text": cached["answer"]})
+            yield sse_event("done", {})
+            await save_conversation(
+                request.session_id,
+                current_user.username,
+                user_msg,
+                build_bot_msg(parts),
+            )
+            return
+
+        started = time.perf_counter()
+        try:
+            async for text in bot.astream_response(
+                request.message, context_chunks
+            ):
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client disconnected mid-answer: keep what was generated so far
+            if parts:
+                asyncio.create_task(
+                    save_conversation(
+                        request.session_id,
+                        current_user.username,
+                        user_msg,
+                        build_bot_msg(parts),
+                    )
+                )
+            raise
+
+        yield sse_event("done", {})
+        response_text = "".join(parts)
+        if (
+            response_text
+            and query_embedding is not None
+            and bot.error is None
+        ):
+            answer_cache.store(
+                query_embedding,
+                index_version,
+                response_text,
+                formatted_sources,
+                time.perf_counter() - started,
+            )
+        await save_conversation(
+            request.session_id,
+            current_user.username,
+            user_msg,
+            build_bot_msg(parts),
+        )
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def template_url(filename: str) -> str:
+    return f"{SUPABASE_LINK_BUCKET}{filename}"
+
+
+async def require_template(filename: str, projection=None):
+    """
+    The contracts record of a template saved by an admin; 404 for any other file name,
+    so clients can't fetch or render arbitrary objects from the bucket.
+    """
+    contract = await contract_collection.find_one(
+        {"filename": filename}, projection or {"_id": 1}
+    )
+    if not contract:
+        raise HTTPException(status_code=404, detail="Contract template not found")
+    return contract
+
+
+def load_template_metadata(filename: str):
+    """
+    Variables and text of a template, parsed from its cached .docx.
+    """
+    data = template_cache.get(filename, template_url(filename))
+    return parse_template(data)
+
+
+def render_contract(filename: str, data: dict) -> bytes:
+    template = template_cache.get(filename, template_url(filename))
+    return render_template(template, data)
 
 
 @app.post("/download-template")
@@ -564,11 +811,20 @@ async def download_template_endpoint(
     filename: str = Body(..., embed=True),
     current_user: UserInDB = Depends(get_current_active_user),
 ):
-    url = f"{SUPABASE_LINK_BUCKET}{filename}"
-    print("Downloading template from URL:", url)
+    contract = await require_template(filename, {"variables": 1, "content": 1})
     try:
-        variables, content = download_template(url)
-        print("Downloaded template variables:", variables)
+        if "variables" in contract:
+            variables, content = contract["variables"], contract["content"]
+        else:
+            # Saved before metadata was stored with the template: compute it once
+            variables, content = await asyncio.to_thread(
+                load_template_metadata, filename
+            )
+            await contract_collection.update_many(
+                {"filename": filename},
+                {"$set": {"variables": variables, "content": content}},
+            )
+        opened_templates.set(current_user.username, filename)
         return {"variables": variables, "content": content}
     except Exception as e:
         raise HTTPException(
@@ -583,73 +839,7 @@ async def chat_contract(
 ):
     global rag_system
 
-    # Use user's Gemini Key if available, else system's (if you want to allow that)
-    # Prompt says: "User just adds gemini key".
-    user_gemini_key = current_user.gemini_api_key
-
-    final_gemini_key = None
-
-    if user_gemini_key:
-        print("User has custom Gemini Key.")
-        final_gemini_key = decrypt_key(user_gemini_key)
-
-    if not final_gemini_key:
-        # Check subscription and limits
-        if current_user.subscription_type == "premium":
-            # Use system key (from env or config)
-            # For now, assuming system key is set in env GOOGLE_API_KEY or similar,
-            # BUT chatbot.py uses the key passed to it.
-            # We need a system-wide key. Let's assume one is in env.
-            final_gemini_key = os.getenv("GOOGLE_API_KEY")
-            if not final_gemini_key:
-                raise HTTPException(
-                    status_code=503, detail="System Gemini Key not configured."
-                )
-        else:
-            # Free user - Check limits
-            today = datetime.utcnow().replace(
-                hour=0, minute=0, second=0, microsecond=0
-            )
-            last_usage = current_user.last_usage_date
-
-            if last_usage and last_usage >= today:
-                if current_user.daily_usage_count >= 5:
-                    raise HTTPException(
-                        status_code=402,
-                        detail="Daily limit reached. Please upgrade or add your own API Key.",
-                    )
-
-                # Increment
-                await db.users.update_one(
-                    {"username": current_user.username},
-                    {
-                        "$inc": {"daily_usage_count": 1},
-                        "$set": {"last_usage_date": datetime.utcnow()},
-                    },
-                )
-            else:
-                # Reset and increment
-                await db.users.update_one(
-                    {"username": current_user.username},
-                    {
-                        "$set": {
-                            "daily_usage_count": 1,
-                            "last_usage_date": datetime.utcnow(),
-                        }
-                    },
-                )
-
-            final_gemini_key = os.getenv("GOOGLE_API_KEY")
-            if not final_gemini_key:
-                raise HTTPException(
-                    status_code=503, detail="System Gemini Key not configured."
-                )
-
-    if not final_gemini_key:
-        raise HTTPException(
-            status_code=400,
-            detail="Please configure your Gemini API Key in settings or upgrade to Premium.",
-        )
+    final_gemini_key = await resolve_gemini_key(current_user)
 
     if not rag_system:
         raise HTTPException(
@@ -657,7 +847,7 @@ async def chat_contract(
             detail="System RAG (Pinecone) not configured by Admin.",
         )
     bot = GeminiBot(final_gemini_key if final_gemini_key else gemini_key)
-    response_raw = bot.generate_response_contract(
+    response_raw = await bot.agenerate_response_contract(
         request.message,
         request.variables,
         request.messages,
@@ -679,15 +869,26 @@ async def chat_contract(
             status_code=500, detail=f"Gemini JSON parse error: {str(e)}"
         )
     if response_json.get("status") == "complete":
-        # Generate contract document
+        # Generate contract document (in memory, off the event loop)
+        filename = request.filename or opened_templates.get(current_user.username)
+        if not filename:
+            raise HTTPException(
+                status_code=400, detail="No contract template selected."
+            )
+        await require_template(filename)
         try:
-            output_path = fill_contract(
-                "output_template.docx", response_json.get("variables", {})
+            data = await asyncio.to_thread(
+                render_contract, filename, response_json.get("variables", {})
+            )
+            output_name = f"hop_dong_{os.path.basename(filename)}"
+            artifact_id = artifact_store.put(
+                current_user.username, data, output_name
             )
             return {
                 "response": "Bấm để tải về",
                 "variables": response_json.get("variables", {}),
-                "link": output_path,
+                "link": artifact_id,
+                "filename": output_name,
             }
         except Exception as e:
             raise HTTPException(
@@ -701,79 +902,138 @@ async def chat_contract(
     }
 
 
+@app.post("/contracts/bulk")
+async def bulk_contracts(
+    filename: str = Form(...),
+    file: UploadFile = File(...),
+    name_field: Optional[str] = Form(None),
+    current_user: UserInDB = Depends(get_current_active_user),
+):
+    """
+    Fill one template with every variable set of a CSV (one row per contract)
+    or JSON array, without Gemini. Contracts are rendered in worker processes
+    and streamed back as a ZIP while the rest are still rendering; name_field
+    is the column used to name each file. Limited per user by bulk_limiter and
+    bulk_jobs (429 when exceeded).
+    """
+    check_rate(bulk_limiter, current_user.username)
+    try:
+        rows = read_rows(await file.read(), file.filename or "")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not rows:
+        raise HTTPException(status_code=400, detail="No rows to render.")
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many rows ({len(rows)}), the limit is {BULK_MAX_ROWS}.",
+        )
+
+    await require_template(filename)
+    try:
+        template = await asyncio.to_thread(
+            template_cache.get, filename, template_url(filename)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=404, detail=f"Error loading template: {str(e)}"
+        )
+
+    release = bulk_jobs.acquire(current_user.username)
+    if release is None:
+        raise HTTPException(
+            status_code=429,
+            detail="A bulk job is already running for this account. Please wait for it to finish.",
+        )
+
+    async def stream():
+        try:
+            async for chunk in stream_zip(
+                render_rows(
+                    template_cache.file_path(filename), template_version(template), rows
+                ),
+                name_field,
+                filename,
+            ):
+                yield chunk
+        finally:
+            release()
+
+    archive_name = f"{os.path.splitext(os.path.basename(filename))[0]}.zip"
+    return StreamingResponse(
+        stream(),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(archive_name)}"
+        },
+        # Also frees the slot if the stream never started
+        background=BackgroundTask(release),
+    )
+
+
 @app.post("/admin/upload")
 async def upload_files(
     files: List[UploadFile] = File(...),
     current_user: User = Depends(get_current_admin_user),
 ):
-    global rag_system
     if not rag_system:
         raise HTTPException(status_code=503, detail="RAG System not configured")
 
-    saved_files = []
-    file_metadata = []
-
+    # Save uploads to disk and hand them to the background ingestion workers
+    uploads = []
     for file in files:
-        file_location = f"temp_{file.filename}"
-        content = await file.read()  # Read async
-        with open(file_location, "wb+") as file_object:
-            file_object.write(content)
-
-        file_size = len(content)
+        path, size = await ingestion_pool.save_upload(file)
+        uploads.append((file.filename, path, size))
 
-        class FileWrapper:
-            def __init__(self, path, name):
-                self.name = name
-                self.path = path
-
-            def getbuffer(self):
-                with open(self.path, "rb") as f:
-                    return f.read()
-
-        saved_files.append(FileWrapper(file_location, file.filename))
-        file_metadata.append(
-            {
-                "filename": file.filename,
-                "size": file_size,
-                "upload_date": datetime.utcnow(),
-                "uploaded_by": current_user.username,
-                "status": "processed",
-            }
-        )
-
-    try:
-        documents = rag_system.load_documents(saved_files)
-        if documents:
-            print(documents)
-            # return
-            rag_system.create_vector_db(documents)
+    job_id = await ingestion_pool.submit(uploads, current_user.username)
+    return {
+        "message": f"Queued {len(uploads)} files for indexing",
+        "job_id": job_id,
+        "status": "queued",
+    }
 
-            # Save metadata to MongoDB
-            if file_metadata:
-                await db.files.insert_many(file_metadata)
 
-            return {
-                "message": f"Successfully processed {len(documents)} documents"
-            }
-        else:
-            raise HTTPException(
-                status_code=400, detail="No documents processed"
-            )
-    finally:
-        for f in saved_files:
-            if os.path.exists(f.path):
-                os.remove(f.path)
+@app.get("/admin/jobs/{job_id}")
+async def get_ingestion_job(
+    job_id: str, current_user: User = Depends(get_current_admin_user)
+):
+    job = await ingestion_pool.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job["job_id"] = job.pop("_id")
+    return job
 
 
 @app.post("/admin/save-template")
 async def save_template(
     file: ContractFile, current_user: User = Depends(get_current_admin_user)
 ):
+    # Download and parse the template once here, not each time a user opens it
+    def fetch_metadata():
+        data = template_cache.refresh(file.filename, template_url(file.filename))
+        return parse_template(data)
+
+    try:
+        variables, content = await asyncio.to_thread(fetch_metadata)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error reading template: {str(e)}"
+        )
+
     # save file to db
-    await contract_collection.insert_one(
-        {"name": file.name, "filename": file.filename}
+    await contract_collection.update_one(
+        {"filename": file.filename},
+        {
+            "$set": {
+                "name": file.name,
+                "variables": variables,
+                "content": content,
+                "updated_at": datetime.utcnow(),
+            }
+        },
+        upsert=True,
     )
-    return {"status": "success"}
+    return {"status": "success", "variables": list(variables)}
 
 
 @app.post("/admin/upload-supabase")
@@ -800,12 +1060,36 @@ async def admin_config(
     PINECONE_API_KEY = config.pinecone_api_key
     PINECONE_INDEX_NAME = config.pinecone_index_name
 
-    rag_system = RAGSystem(PINECONE_API_KEY, PINECONE_INDEX_NAME)
+    # Cheap to rebuild: the embedding model is shared, not reloaded
+    rag_system = RAGSystem(
+        PINECONE_API_KEY, PINECONE_INDEX_NAME, VECTOR_BACKEND, LOCAL_INDEX_PATH
+    )
     success = rag_system.load_index()
+    answer_cache.invalidate()
 
     return {"status": "success", "pinecone_connected": success}
 
 
+@app.get("/admin/cache-stats")
+async def cache_stats(current_user: User = Depends(get_current_admin_user)):
+    return {
+        "answers": answer_cache.stats(),
+        "decrypted_keys": key_cache_stats(),
+        "users": user_cache.stats(),
+        "rate_limits": {
+            "login": login_limiter.stats(),
+            "register": register_limiter.stats(),
+            "bulk": bulk_limiter.stats(),
+            "bulk_jobs": bulk_jobs.stats(),
+        },
+        "retrieval": rag_system.cache_stats() if rag_system else None,
+        "message_writes": message_store.stats(),
+        "gemini_clients": gemini_pool.stats(),
+        "templates": template_cache.stats(),
+        "artifacts": artifact_store.stats(),
+    }
+
+
 @app.get("/admin/users", response_model=List[User])
 async def get_all_users(current_user: User = Depends(get_current_admin_user)):
     users_cursor = users_collection.find({})
@@ -827,6 +1111,7 @@ async def update_user_status(
     result = await users_collection.update_one(
         {"username": username}, {"$set": {"disabled": disabled}}
     )
+    invalidate_user(username)
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     return {
@@ -837,37 +1122,60 @@ async def update_user_status(
 
 @app.get("/history", response_model=List[dict])
 async def get_history_list(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_active_user),
 ):
-    # Return list of conversations (id, title, date)
-    cursor = conversations_collection.find(
-        {"user_id": current_user.username}
-    ).sort("updated_at", -1)
-    conversations = await cursor.to_list(length=100)
-    result = []
-    for conv in conversations:
-        result.append(
-            {
-                "session_id": conv["session_id"],
-                "title": conv.get("title", "New Chat"),
-                "updated_at": conv["updated_at"],
-            }
+    """
+    A page of the user's conversations (session_id, title, updated_at), newest first.
+    The cursor for the next page is returned in the X-Next-Cursor header.
+    """
+    try:
+        result, next_cursor = await message_store.list_conversations(
+            current_user.username, limit, cursor
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return result
 
 
 @app.get("/history/{session_id}")
 async def get_history_detail(
-    session_id: str, current_user: User = Depends(get_current_active_user)
+    session_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[int] = None,
+    include_sources: bool = False,
+    current_user: User = Depends(get_current_active_user),
 ):
-    conv = await conversations_collection.find_one(
-        {"session_id": session_id, "user_id": current_user.username}
+    """
+    The conversation with its latest `limit` messages (before seq `before`), in
+    chronological order. next_cursor is the `before` value for older messages.
+    Sources carry only file and page unless include_sources is set.
+    """
+    conv, messages, next_cursor = await message_store.page(
+        session_id, current_user.username, limit, before
     )
     if not conv:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
+    if include_sources:
+        # Sources are stored as chunk references; fetch their text from the index
+        get_chunk_texts = (
+            rag_system.get_chunk_texts if rag_system else (lambda ids: {})
+        )
+        messages = await asyncio.to_thread(
+            resolve_sources, messages, get_chunk_texts
+        )
+    else:
+        messages = strip_sources(messages)
+
     if "_id" in conv:
         conv["_id"] = str(conv["_id"])
+    conv["messages"] = messages
+    conv["next_cursor"] = next_cursor
     return conv
 
 
@@ -901,7 +1209,8 @@ async def listFile(current_user: User = Depends(get_current_admin_user)):
 
 @app.get("/contract")
 async def get_contracts(current_user: User = Depends(get_current_active_user)):
-    contracts_cursor = db.contracts.find({})
+    # Template text and variables are only needed once a template is opened
+    contracts_cursor = db.contracts.find({}, {"variables": 0, "content": 0})
     contracts = await contracts_cursor.to_list(length=100)
     for contract in contracts:
         if "_id" in contract:
@@ -936,16 +1245,22 @@ async def checkFile(
         return {"exists": False}
 
 
-@app.get("/download/{filename}")
+@app.get("/download/{artifact_id}")
 async def download_file(
-    filename: str, current_user: UserInDB = Depends(get_current_active_user)
+    artifact_id: str, current_user: UserInDB = Depends(get_current_active_user)
 ):
-    file_path = os.path.join("", filename)  # Đường dẫn thư mục chứa file
-    print(f"Looking for file at: {file_path}")
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(
-        file_path, media_type="application/octet-stream", filename=filename
+    """
+    A file generated for the current user (e.g. a filled contract), while it hasn't expired.
+    """
+    artifact = artifact_store.get(artifact_id, current_user.username)
+    if not artifact:
+        raise HTTPException(status_code=404, detail="File not found or expired")
+    return Response(
+        content=artifact["data"],
+        media_type=artifact["media_type"],
+        headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(artifact['filename'])}"
+        },
     )
 
 
@@ -0,0 +1,415 @@
+import os
+import json
+import time
+import base64
+import asyncio
+from datetime import datetime
+from bson import ObjectId
+from pymongo import InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from context_packer import merge_overlapping
+
+# Write-behind: pending message pairs are persisted every WRITE_BEHIND_INTERVAL_MS,
+# or as soon as WRITE_BEHIND_MAX_BATCH pairs are waiting
+WRITE_BEHIND_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_INTERVAL_MS", 200))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", 100))
+# Attempts for a pair rejected by Mongo (e.g. oversized or invalid document) before it is dropped
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", 5))
+# Longest wait between flushes while Mongo is unreachable
+WRITE_BEHIND_MAX_BACKOFF = 30
+
+# Mongo error code of a duplicate key (a message already written by an earlier attempt)
+DUPLICATE_KEY = 11000
+
+
+def encode_cursor(updated_at, conversation_id):
+    raw = json.dumps([updated_at.isoformat(), str(conversation_id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    (updated_at, ObjectId) from a /history cursor; raises ValueError if malformed.
+    """
+    try:
+        updated_at, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(updated_at), ObjectId(conversation_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def source_refs(sources):
+    """
+    Sources as stored with a message: chunk ids instead of the chunk text.
+    Sources without chunk ids (chunks indexed before content-hashed ids) keep their text.
+    """
+    refs = []
+    for source in sources:
+        ref = {"source": source.get("source", "Unknown"), "page": source.get("page", 1)}
+        if source.get("chunk_ids"):
+            ref["chunk_ids"] = source["chunk_ids"]
+        else:
+            ref["content"] = source.get("content", "")
+        refs.append(ref)
+    return refs
+
+
+class MessageStore:
+    """
+    Chat history split in two collections: one small document per conversation
+    (title, timestamps) and one document per message in `messages`, keyed by
+    (user_id, session_id, seq). Appending a message costs the same however long
+    the conversation is.
+
+    Writes are write-behind: append() only queues the message pair, and a
+    background task persists everything queued with one bulk_write per
+    collection (one upsert per conversation, one insert per message). Reads
+    merge the queued pairs, so a user always sees their own latest messages.
+    Sequence numbers come from the clock (microseconds, strictly increasing in
+    this process), so no round trip is needed to reserve them.
+
+    A failed batch (Mongo unreachable) is retried with backoff. A pair Mongo
+    rejects on its own is retried up to max_attempts times, then dropped and
+    logged. Messages get their _id when queued and retries replace by _id, so
+    a retry never duplicates what an earlier attempt wrote; a (user, session,
+    seq) collision with another process gets the pair new seqs instead.
+
+    Conversations saved before this layout keep their embedded `messages`
+    array; they are returned first, followed by the stored messages.
+    """
+
+    def __init__(
+        self,
+        conversations_collection,
+        messages_collection,
+        flush_interval_ms=WRITE_BEHIND_INTERVAL_MS,
+        max_batch=WRITE_BEHIND_MAX_BATCH,
+        max_attempts=WRITE_BEHIND_MAX_ATTEMPTS,
+    ):
+        self.conversations = conversations_collection
+        self.messages = messages_collection
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self._backoff = self.flush_interval
+        self._pending = []
+        self._flushing = []
+        self._last_seq = 0
+        self._wake = None
+        self._flush_lock = None
+        self._task = None
+
+        self.flushed_pairs = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped_pairs = 0
+
+    async def start(self):
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """
+        Stop the background task and persist everything still queued.
+        """
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self._pending:
+            print(f"WARNING: {len(self._pending)} message pairs could not be saved.")
+
+    def _next_seq(self):
+        seq = max(time.time_ns() // 1000, self._last_seq + 1)
+        self._last_seq = seq + 1
+        return seq
+
+    def append(self, session_id, username, user_msg, bot_msg):
+        """
+        Queue a user/assistant message pair; the conversation is created if needed
+        when the pair is persisted.
+        """
+        now = datetime.utcnow()
+        message = user_msg["content"]
+        title = message[:50] + "..." if len(message) > 50 else message
+        key = {"session_id": session_id, "user_id": username}
+        seq = self._next_seq()
+        self._pending.append(
+            {
+                "key": key,
+                "title": title,
+                "time": now,
+                "attempts": 0,
+                "tried": False,
+                "messages": [
+                    {**user_msg, **key, "_id": ObjectId(), "seq": seq},
+                    {**bot_msg, **key, "_id": ObjectId(), "seq": seq + 1, "sources": source_refs(bot_msg.get("sources", []))},
+                ],
+            }
+        )
+        if self._wake and len(self._pending) >= self.max_batch:
+            self._wake.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        """
+        Persist the queued pairs. Pairs that could not be written are queued again
+        (ahead of newer pairs) and retried on the next flush.
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            self._flushing = batch
+            try:
+                rejected = await self._write(batch)
+            except Exception as e:
+                print(f"Failed to save {len(batch)} message pairs, will retry: {e}")
+                self.failed_flushes += 1
+                self._backoff = min(self._backoff * 2, WRITE_BEHIND_MAX_BACKOFF)
+                self._pending = batch + self._pending
+                return
+            finally:
+                self._flushing = []
+
+            self._backoff = self.flush_interval
+            self.flushes += 1
+            self.flushed_pairs += len(batch) - len(rejected)
+            retry = []
+            for pair, error in rejected:
+                pair["attempts"] += 1
+                if pair["attempts"] >= self.max_attempts:
+                    self.dropped_pairs += 1
+                    print(f"Dropping message pair of session {pair['key']['session_id']} after {pair['attempts']} attempts: {error}")
+                else:
+                    retry.append(pair)
+            self._pending = retry + self._pending
+
+    async def _write(self, batch):
+        """
+        Write a batch; returns the (pair, error) list of pairs Mongo rejected.
+        Raises when the batch as a whole failed.
+        """
+        rejected = {}
+        # One upsert per conversation: first title wins, latest time is kept
+        conversations = {}
+        for pair in batch:
+            key = (pair["key"]["session_id"], pair["key"]["user_id"])
+            conv = conversations.setdefault(key, {"key": pair["key"], "title": pair["title"], "created_at": pair["time"], "pairs": []})
+            conv["updated_at"] = pair["time"]
+            conv["pairs"].append(pair)
+        conversations = list(conversations.values())
+        try:
+            await self.conversations.bulk_write(
+                [
+                    UpdateOne(
+                        conv["key"],
+                        {
+                            "$max": {"updated_at": conv["updated_at"]},
+                            "$setOnInsert": {"title": conv["title"], "created_at": conv["created_at"]},
+                        },
+                        upsert=True,
+                    )
+                    for conv in conversations
+                ],
+                ordered=False,
+            )
+        except BulkWriteError as e:
+            if e.details.get("writeConcernErrors"):
+                raise
+            for error in e.details.get("writeErrors", []):
+                for pair in conversations[error["index"]]["pairs"]:
+                    rejected[id(pair)] = (pair, error.get("errmsg"))
+
+        # Messages of conversations that couldn't be written wait for their next attempt
+        owners = [(pair, message) for pair in batch if id(pair) not in rejected for message in pair["messages"]]
+        if not owners:
+            return list(rejected.values())
+        operations = [
+            # Retries replace by _id: an earlier attempt may have written the message
+            ReplaceOne({"_id": message["_id"]}, dict(message), upsert=True) if pair["tried"] else InsertOne(dict(message))
+            for pair, message in owners
+        ]
+        for pair, _ in owners:
+            pair["tried"] = True
+        try:
+            await self.messages.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            if e.details.get("writeConcernErrors"):
+                raise
+            for error in e.details.get("writeErrors", []):
+                pair, _ = owners[error["index"]]
+                if error.get("code") == DUPLICATE_KEY and id(pair) not in rejected:
+                    # Seq already used (clock stepped back, or another process): renumber the pair
+                    seq = self._next_seq()
+                    pair["messages"][0]["seq"], pair["messages"][1]["seq"] = seq, seq + 1
+                rejected[id(pair)] = (pair, error.get("errmsg"))
+        return list(rejected.values())
+
+    def _queued(self, username, session_id=None):
+        # Pairs being written are still read from memory until the write completes
+        return [
+            pair
+            for pair in self._flushing + self._pending
+            if pair["key"]["user_id"] == username and (session_id is None or pair["key"]["session_id"] == session_id)
+        ]
+
+    def stats(self):
+        return {
+            "pending_pairs": len(self._pending) + len(self._flushing),
+            "flushed_pairs": self.flushed_pairs,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "dropped_pairs": self.dropped_pairs,
+        }
+
+    async def list_conversations(self, username, limit=50, cursor=None):
+        """
+        One page of a user's conversations, newest first, with only the sidebar fields.
+        Keyset pagination on (updated_at, _id). Returns (items, next_cursor).
+        """
+        query = {"user_id": username}
+        if cursor:
+            updated_at, conversation_id = decode_cursor(cursor)
+            query["$or"] = [
+                {"updated_at": {"$lt": updated_at}},
+                {"updated_at": updated_at, "_id": {"$lt": conversation_id}},
+            ]
+        docs = await (
+            self.conversations.find(query, {"session_id": 1, "title": 1, "updated_at": 1})
+            .sort([("updated_at", -1), ("_id", -1)])
+            .limit(limit)
+            .to_list(length=limit)
+        )
+        next_cursor = encode_cursor(docs[-1]["updated_at"], docs[-1]["_id"]) if len(docs) == limit else None
+        items = {
+            doc["session_id"]: {"session_id": doc["session_id"], "title": doc.get("title", "New Chat"), "updated_at": doc["updated_at"]}
+            for doc in docs
+        }
+        if not cursor:
+            # Conversations with queued messages are the most recent ones
+            for pair in self._queued(username):
+                session_id = pair["key"]["session_id"]
+                item = items.setdefault(session_id, {"session_id": session_id, "title": pair["title"], "updated_at": pair["time"]})
+                item["updated_at"] = max(item["updated_at"], pair["time"])
+        items = sorted(items.values(), key=lambda item: item["updated_at"], reverse=True)
+        return items, next_cursor
+
+    async def page(self, session_id, username, limit=50, before=None):
+        """
+        The conversation (without messages) and one page of its messages: the `limit`
+        latest messages with seq < before, in chronological order. Returns
+        (conversation, messages, next_cursor); next_cursor is the `before` value for
+        the previous page, or None at the start of the conversation. Messages
+        embedded by the old layout get seqs -n..-1, before every stored message.
+        Queued (not yet persisted) messages are included.
+        """
+        key = {"session_id": session_id, "user_id": username}
+        queued = self._queued(username, session_id)
+        conv = await self.conversations.find_one(
+            key,
+            {
+                "session_id": 1,
+                "user_id": 1,
+                "title": 1,
+                "created_at": 1,
+                "updated_at": 1,
+                "legacy_count": {"$size": {"$ifNull": ["$messages", []]}},
+            },
+        )
+        if not conv:
+            if not queued:
+                return None, [], None
+            # Not persisted yet
+            conv = {**key, "title": queued[0]["title"], "created_at": queued[0]["time"], "updated_at": queued[0]["time"]}
+        legacy_count = conv.pop("legacy_count", 0)
+        for pair in queued:
+            conv["updated_at"] = max(conv["updated_at"], pair["time"])
+
+        query = dict(key)
+        if before is not None:
+            query["seq"] = {"$lt": before}
+        # One extra row tells whether an older page exists
+        newest = await (
+            self.messages.find(query, {"_id": 0, "session_id": 0, "user_id": 0})
+            .sort("seq", -1)
+            .limit(limit + 1)
+            .to_list(length=limit + 1)
+        )
+        # Queued messages (copied, callers rewrite their sources); a pair being
+        # written may already be in the results
+        stored = {message["seq"] for message in newest}
+        newest += [
+            {field: value for field, value in message.items() if field not in key and field != "_id"}
+            for pair in queued
+            for message in pair["messages"]
+            if message["seq"] not in stored and (before is None or message["seq"] < before)
+        ]
+        newest.sort(key=lambda message: message["seq"])
+        older = len(newest) > limit
+        messages = newest[-limit:]
+
+        # Fill the rest of the page from the embedded (legacy) messages
+        remaining = limit - len(messages)
+        end = legacy_count + min(before, 0) if before is not None else legacy_count
+        start = max(0, end - remaining)
+        if remaining and end > start:
+            doc = await self.conversations.find_one(key, {"messages": {"$slice": [start, end - start]}, "_id": 0})
+            legacy = doc.get("messages", []) if doc else []
+            for position, message in enumerate(legacy):
+                message["seq"] = start + position - legacy_count
+            messages = legacy + messages
+        if not older:
+            # Older legacy messages remain before this page's first one
+            older = start > 0 if remaining else end > 0
+
+        next_cursor = messages[0]["seq"] if messages and older else None
+        return conv, messages, next_cursor
+
+
+def strip_sources(messages):
+    """
+    Keep only the source name and page of each source (no chunk text).
+    """
+    for message in messages:
+        message["sources"] = [
+            {"source": source.get("source", "Unknown"), "page": source.get("page", 1)}
+            for source in message.get("sources") or []
+        ]
+    return messages
+
+
+def resolve_sources(messages, get_chunk_texts):
+    """
+    Replace chunk references in messages' sources with the chunk text, using
+    get_chunk_texts(ids) -> {chunk_id: text}. Chunks deleted from the index resolve
+    to an empty text; source name and page are kept.
+    """
+    ids = [
+        chunk_id
+        for message in messages
+        for source in message.get("sources") or []
+        for chunk_id in source.get("chunk_ids", [])
+    ]
+    texts = get_chunk_texts(ids) if ids else {}
+    for message in messages:
+        resolved = []
+        for source in message.get("sources") or []:
+            if "chunk_ids" in source:
+                content = merge_overlapping([texts[i] for i in source["chunk_ids"] if i in texts])
+                source = {"content": content, "source": source["source"], "page": source["page"]}
+            resolved.append(source)
+        message["sources"] = resolved
+    return messages
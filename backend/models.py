@@ -60,6 +60,8 @@ class ChatContractRequest(BaseModel):
     variables: Optional[dict] = {}
     messages: Optional[List[MessageForContract]] = []
     contentTemplate: Optional[str] = None
+    # file name of the template being filled (the one last opened when omitted)
+    filename: Optional[str] = None
     
 class ConfigRequest(BaseModel):
     pinecone_api_key: str
@@ -0,0 +1,109 @@
+import os
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# File names inside the exported model folder
+QUANTIZED_FILE = "model.int8.onnx"
+FP32_FILE = "model.onnx"
+# vietnamese-sbert (PhoBERT) truncates inputs to 256 tokens in sentence-transformers
+MAX_LENGTH = 256
+
+
+def export_quantized(model_name, output_dir, max_length=MAX_LENGTH):
+    """
+    Export a Hugging Face sentence encoder to ONNX and quantize its weights to int8.
+    Needs torch, transformers, onnx and onnxruntime; only used once per model.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    sample = tokenizer(["Bộ luật Lao động"], return_tensors="pt", truncation=True, max_length=max_length)
+
+    fp32_path = os.path.join(output_dir, FP32_FILE)
+    axes = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": axes, "attention_mask": axes, "last_hidden_state": axes},
+            opset_version=17,
+            dynamo=False,
+        )
+    quantize_dynamic(fp32_path, os.path.join(output_dir, QUANTIZED_FILE), weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(output_dir)
+    os.remove(fp32_path)
+    print(f"Exported int8 ONNX model for {model_name} to {output_dir}")
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Sentence embeddings from an int8-quantized ONNX export, run with ONNX Runtime on CPU.
+
+    Same tokenizer and mean pooling as HuggingFaceEmbeddings with the original model,
+    so vectors stay comparable with an index built by the PyTorch engine
+    (see benchmark_embeddings.py for the parity check).
+    """
+
+    def __init__(self, model_dir, batch_size=32, max_length=MAX_LENGTH, threads=None):
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError("The ONNX embedding engine needs `pip install onnxruntime onnx`") from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, QUANTIZED_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+        self.max_length = max_length
+        # The Rust tokenizer is not safe to call from several threads at once
+        self._tokenizer_lock = threading.Lock()
+
+    @classmethod
+    def from_model(cls, model_name, model_dir, **kwargs):
+        """
+        Load the quantized export from model_dir, exporting model_name first if it is missing.
+        """
+        if not os.path.exists(os.path.join(model_dir, QUANTIZED_FILE)):
+            export_quantized(model_name, model_dir, kwargs.get("max_length", MAX_LENGTH))
+        return cls(model_dir, **kwargs)
+
+    def _encode(self, texts):
+        with self._tokenizer_lock:
+            encoded = self.tokenizer(
+                texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+            )
+        inputs = {name: encoded[name].astype("int64") for name in self.input_names if name in encoded}
+        hidden = self.session.run(None, inputs)[0]
+
+        # Mean pooling over real (non-padding) tokens
+        mask = encoded["attention_mask"][..., None].astype("float32")
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def embed_documents(self, texts):
+        texts = [text.replace("\n", " ") for text in texts]
+        # Batch texts of similar length together to limit padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            positions = order[start:start + self.batch_size]
+            for position, vector in zip(positions, self._encode([texts[i] for i in positions])):
+                vectors[position] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -1,76 +1,367 @@
 import os
+import re
 import time
+import array
+import asyncio
+import hashlib
+import tempfile
+import threading
+import unicodedata
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from legal_splitter import VietnameseLegalTextSplitter
 from langchain_pinecone import PineconeVectorStore
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from pinecone import Pinecone, ServerlessSpec
+from vector_store import LocalVectorStore
+from cache import LRUCache
+from embedding_registry import registry as embedding_registry
+from embedding_service import EmbeddingBatcher
+from embedding_cache import EmbeddingCache, chunk_id, content_hash, source_prefix
+from lexical_index import BM25Index
+from context_packer import ContextPacker
+
+# Per-stage concurrency limits for the async pipeline. Embedding is CPU bound,
+# so only a few encodes (batches) run at once; vector queries are mostly I/O.
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 2))
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", 8))
+_search_semaphore = asyncio.Semaphore(SEARCH_CONCURRENCY)
+
+# Query embeddings arriving within EMBED_BATCH_MAX_WAIT_MS are encoded together
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", 32))
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", 5))
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 2048))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 1024))
+
+
+def normalize_query(query, lower=True):
+    """
+    Query for matching and cache keys: NFC-normalized, whitespace collapsed and
+    (unless lower=False) lower-cased.
+    """
+    query = unicodedata.normalize("NFC", query or "")
+    query = re.sub(r"\s+", " ", query).strip()
+    return query.lower() if lower else query
+
+
+def _embedding_key(embedding):
+    return hashlib.sha1(array.array("f", embedding).tobytes()).hexdigest()
+
+
+EMBEDDING_MODEL = "keepitreal/vietnamese-sbert"
+# "torch" (HuggingFaceEmbeddings) or "onnx" (int8-quantized ONNX Runtime export, CPU)
+EMBEDDING_ENGINE = os.getenv("EMBEDDING_ENGINE", "torch")
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH", "onnx_model")
+CHUNK_EMBEDDING_CACHE_PATH = os.getenv("CHUNK_EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+
+# Ingestion pipeline: chunks embedded per batch, and batches upserted in parallel
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))
+UPSERT_CONCURRENCY = int(os.getenv("UPSERT_CONCURRENCY", 4))
+
+
+# Hybrid retrieval: chunks returned per query after fusing the dense and BM25 rankings
+RETRIEVE_K = int(os.getenv("RETRIEVE_K", 8))
+RRF_K = 60
+# Parent folder of the BM25 indexes; each vector index gets its own subfolder
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "lexical_index")
+
+
+def lexical_index_path(vector_backend, index_name=None, index_path=None):
+    """
+    Folder of the BM25 index that mirrors one vector index (a Pinecone index name
+    or a local index folder), so switching indexes never mixes two corpora.
+    """
+    name = index_path if vector_backend == "local" else index_name
+    name = re.sub(r"[^\w.-]+", "_", os.path.basename(os.path.normpath(name or "default")))
+    return os.path.join(LEXICAL_INDEX_PATH, f"{vector_backend}-{name}")
+
+# Context sent to Gemini: token budget after merging/reranking, and MMR relevance/diversity trade-off
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2500))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.7))
+
+# Exact references such as "Điều 36", "khoản 2" or "145/2020/NĐ-CP"
+CITATION_RE = re.compile(r"\b(?:điều|khoản|điểm)\s+\d+|\b\d+/\d{4}/[a-zđ\-]+", re.IGNORECASE)
+CITATION_MAX_WORDS = 12
+ARTICLE_REF_RE = re.compile(r"\bđiều\s+(\d+[a-zđ]?)\b")
+
+
+def is_citation_query(query):
+    """
+    A short query built around a legal reference; BM25 alone answers it, so embedding is skipped.
+    """
+    query = normalize_query(query)
+    return bool(CITATION_RE.search(query)) and len(query.split()) <= CITATION_MAX_WORDS
+
+
+def _document_key(doc):
+    return doc.metadata.get("chunk_id") or doc.id or content_hash(doc.page_content)
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Merge ranked Document lists: each document scores sum(1 / (k + rank)) over the lists it appears in.
+    """
+    scores, documents = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = _document_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            documents.setdefault(key, doc)
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+def load_embeddings(engine):
+    if engine == "onnx":
+        from onnx_embeddings import OnnxEmbeddings
+
+        return OnnxEmbeddings.from_model(EMBEDDING_MODEL, ONNX_MODEL_PATH)
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+
+def get_embeddings(engine=None):
+    """
+    The process-wide embedding model for an engine, loaded on first use.
+    """
+    engine = engine or EMBEDDING_ENGINE
+    return embedding_registry.get(f"{EMBEDDING_MODEL}@{engine}", lambda: load_embeddings(engine))
+
+
+_embedding_services = {}
+
+
+def get_embedding_service(engine=None):
+    """
+    The process-wide micro-batching service for query embeddings of an engine.
+    """
+    engine = engine or EMBEDDING_ENGINE
+    if engine not in _embedding_services:
+        _embedding_services[engine] = EmbeddingBatcher(
+            lambda texts: get_embeddings(engine).embed_documents(texts),
+            max_batch_size=EMBED_BATCH_MAX_SIZE,
+            max_wait_ms=EMBED_BATCH_MAX_WAIT_MS,
+            concurrency=EMBED_CONCURRENCY,
+        )
+    return _embedding_services[engine]
+
+
+def warm_up_embeddings(engine=None):
+    engine = engine or EMBEDDING_ENGINE
+    return embedding_registry.warm_up(f"{EMBEDDING_MODEL}@{engine}", lambda: load_embeddings(engine))
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class _Counter:
+    """
+    Pass-through iterator that counts the items it yields.
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = next(self._iterator)
+        self.count += 1
+        return item
+
+
+class IngestStats:
+    """
+    Counters and wall time per ingestion stage (load+split, embed, upsert).
+    """
+
+    def __init__(self):
+        self.pages = 0
+        self.chunks = 0
+        self.skipped = 0
+        self.duplicates = 0
+        self.embedded = 0
+        self.upserted = 0
+        self.deleted = 0
+        self.split_seconds = 0.0
+        self.embed_seconds = 0.0
+        self.upsert_seconds = 0.0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def timed_upsert(self, upsert, chunks, vectors):
+        started = time.perf_counter()
+        count = upsert(chunks, vectors)
+        with self._lock:
+            self.upsert_seconds += time.perf_counter() - started
+        return count
+
+    def collect(self, futures):
+        for future in futures:
+            # Re-raises upsert errors in the ingesting thread
+            self.upserted += future.result()
+
+    @staticmethod
+    def _rate(count, seconds):
+        return round(count / seconds, 2) if seconds else None
+
+    def as_dict(self):
+        return {
+            "pages": self.pages,
+            "chunks": self.chunks,
+            # Unchanged chunks already in the index are skipped; embedded counts cache misses only
+            "skipped": self.skipped,
+            # Chunks repeating the text of another chunk on the same page of the source
+            "duplicates": self.duplicates,
+            "embedded": self.embedded,
+            "upserted": self.upserted,
+            "deleted": self.deleted,
+            "total_seconds": round(time.perf_counter() - self.started, 3),
+            "split": {"seconds": round(self.split_seconds, 3), "pages_per_second": self._rate(self.pages, self.split_seconds)},
+            "embed": {"seconds": round(self.embed_seconds, 3), "chunks_per_second": self._rate(self.chunks, self.embed_seconds)},
+            # Upsert time is summed across parallel workers
+            "upsert": {"seconds": round(self.upsert_seconds, 3), "chunks_per_second": self._rate(self.upserted, self.upsert_seconds)},
+        }
 
 class RAGSystem:
-    def __init__(self, pinecone_api_key=None, index_name=None):
-        self.embeddings = HuggingFaceEmbeddings(model_name="keepitreal/vietnamese-sbert")
+    def __init__(self, pinecone_api_key=None, index_name=None, vector_backend=None, index_path=None, chunker=None, embedding_engine=None):
+        # "pinecone" (cloud) or "local" (in-process HNSW index persisted under index_path)
+        self.vector_backend = vector_backend or os.getenv("VECTOR_BACKEND", "pinecone")
+        self.index_path = index_path or os.getenv("LOCAL_INDEX_PATH", "vector_index")
+        # The model itself lives in the process-wide registry and is shared across instances
+        self.embedding_engine = embedding_engine or EMBEDDING_ENGINE
         self.vector_db = None
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=300,
-            separators=["\n\n", "\n", " ", ""]
-        )
+        self._open_lock = threading.Lock()
+        # "legal" splits along Phần/Chương/Mục/Điều/Khoản/Điểm; "recursive" is the old 1000/300 splitter
+        self.chunker = chunker or os.getenv("CHUNKER", "legal")
+        if self.chunker == "legal":
+            self.text_splitter = VietnameseLegalTextSplitter()
+        else:
+            self.text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=1000,
+                chunk_overlap=300,
+                separators=["\n\n", "\n", " ", ""]
+            )
         self.pinecone_api_key = pinecone_api_key
         if pinecone_api_key:
             os.environ["PINECONE_API_KEY"] = pinecone_api_key
         self.index_name = index_name
 
-    def load_documents(self, files):
+        # Level 1: query text -> embedding. Level 2: (embedding, k, index version) -> chunks.
+        # The index version is bumped on every write so stale results are never served.
+        self.index_version = 0
+        self._embedding_cache = LRUCache(maxsize=EMBEDDING_CACHE_SIZE)
+        self._result_cache = LRUCache(maxsize=RESULT_CACHE_SIZE)
+
+        # On-disk chunk embeddings keyed by content hash, reused across re-uploads and rebuilds
+        # Quantized vectors differ slightly from the PyTorch ones, so each engine has its own entries
+        cache_model = EMBEDDING_MODEL if self.embedding_engine == "torch" else f"{EMBEDDING_MODEL}@{self.embedding_engine}"
+        self.chunk_embedding_cache = EmbeddingCache(CHUNK_EMBEDDING_CACHE_PATH, cache_model)
+
+        # BM25 index over the same chunks, built at ingest time and fused with vector search
+        self.lexical_index_path = lexical_index_path(self.vector_backend, self.index_name, self.index_path)
+        self.lexical_index = BM25Index.load(self.lexical_index_path)
+        if not len(self.lexical_index) and BM25Index.exists(LEXICAL_INDEX_PATH):
+            print(
+                f"WARNING: {LEXICAL_INDEX_PATH} holds a BM25 index not tied to a vector index; "
+                f"re-upload the documents to build {self.lexical_index_path}."
+            )
+
+        self.context_packer = ContextPacker(token_budget=CONTEXT_TOKEN_BUDGET, mmr_lambda=MMR_LAMBDA)
+
+    @property
+    def embeddings(self):
+        return get_embeddings(self.embedding_engine)
+
+    def _bump_index_version(self):
+        self.index_version += 1
+        self._result_cache.clear()
+
+    def cache_stats(self):
+        return {
+            "index_version": self.index_version,
+            "embeddings": self._embedding_cache.stats(),
+            "results": self._result_cache.stats(),
+            "chunk_embeddings": self.chunk_embedding_cache.stats(),
+            "lexical_chunks": len(self.lexical_index),
+            "embedding_models": embedding_registry.stats(),
+            "embedding_batches": get_embedding_service(self.embedding_engine).stats(),
+        }
+
+    def iter_documents(self, files):
         """
-        Load documents from a list of uploaded files (Streamlit UploadedFile objects).
-        Returns a list of Document objects.
+        Lazily load documents from uploaded files, one page at a time.
+        Files may expose a `path` on disk; otherwise their buffer is written to a temp file.
         """
-        documents = []
         for file in files:
             file_extension = os.path.splitext(file.name)[1].lower()
-            
-            # Save temp file to read
-            with open(file.name, "wb") as f:
-                f.write(file.getbuffer())
-            
+            if file_extension not in (".pdf", ".txt"):
+                continue
+
+            path = getattr(file, "path", None)
+            temp_path = None
+            if not path or not os.path.exists(path):
+                # Save temp file to read
+                with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as f:
+                    f.write(file.getbuffer())
+                    temp_path = path = f.name
+
             try:
                 if file_extension == ".pdf":
-                    loader = PyPDFLoader(file.name)
-                    file_docs = loader.load()
-                elif file_extension == ".txt":
-                    loader = TextLoader(file.name, encoding="utf-8")
-                    file_docs = loader.load()
+                    loader = PyPDFLoader(path)
                 else:
-                    continue
+                    loader = TextLoader(path, encoding="utf-8")
 
-                # Attach metadata to each document
-                for doc in file_docs:
-                    print("Adding metadata for document from file:", file.name)
+                print("Loading document from file:", file.name)
+                for doc in loader.lazy_load():
                     # Preserve existing metadata (like page number from PyPDFLoader)
                     # Update source to be just the filename, not the full temp path
                     doc.metadata["source"] = file.name
                     if "page" not in doc.metadata:
                         doc.metadata["page"] = 0 # Default for text files
-
-                documents.extend(file_docs)
+                    yield doc
             finally:
                 # Clean up temp file
-                if os.path.exists(file.name):
-                    os.remove(file.name)
-        
-        return documents
+                if temp_path and os.path.exists(temp_path):
+                    os.remove(temp_path)
 
-    def create_vector_db(self, documents):
+    def load_documents(self, files):
         """
-        Create (or update) a Pinecone vector database from a list of Documents.
+        Load documents from a list of uploaded files (Streamlit UploadedFile objects).
+        Returns a list of Document objects.
         """
-        if not documents or not self.pinecone_api_key or not self.index_name:
-            print("Missing documents, API key, or index name.")
-            return None
+        return list(self.iter_documents(files))
+
+    def iter_chunks(self, documents):
+        """
+        Split documents as a stream so only the current page (or article) is held in memory.
+        """
+        if self.chunker == "legal":
+            yield from self.text_splitter.iter_split(documents)
+            return
+        for doc in documents:
+            yield from self.text_splitter.split_documents([doc])
 
-        chunks = self.text_splitter.split_documents(documents)
-        # print(f"Chunks: {chunks}")
+    @property
+    def is_local(self):
+        return self.vector_backend == "local"
 
+    def is_configured(self):
+        if self.is_local:
+            return True
+        return bool(self.pinecone_api_key and self.index_name)
+
+    def _ensure_pinecone_index(self):
         # Initialize Pinecone Client to check/create index
         pc = Pinecone(api_key=self.pinecone_api_key)
 
@@ -89,41 +380,378 @@ class RAGSystem:
                     time.sleep(1)
             except Exception as e:
                 print(f"Error creating index: {e}")
-                return None
+                return False
+        return True
+
+    def _open_for_writes(self):
+        # Ingestion workers run concurrently: only the first one may create the store
+        with self._open_lock:
+            if self.is_local:
+                if self.vector_db is None and not self.load_index():
+                    self.vector_db = LocalVectorStore(self.embeddings)
+                return True
 
+            if not self._ensure_pinecone_index():
+                return False
+            if self.vector_db is None:
+                self.vector_db = PineconeVectorStore(index_name=self.index_name, embedding=self.embeddings)
+            return True
+
+    def list_chunk_ids(self, source):
+        """
+        Ids of the chunks currently indexed for a source file.
+        """
+        prefix = source_prefix(source)
+        if self.is_local:
+            return self.vector_db.list_ids(prefix)
+        ids = []
+        for page in self.vector_db.index.list(prefix=prefix):
+            ids.extend(page)
+        return ids
+
+    def delete_chunk_ids(self, ids):
+        ids = list(ids)
+        self.lexical_index.delete(ids)
+        if self.is_local:
+            self.vector_db.delete(ids=ids)
+            return
+        for start in range(0, len(ids), 1000):
+            self.vector_db.index.delete(ids=ids[start:start + 1000])
+
+    def embed_chunks(self, chunks):
+        """
+        Embed chunk texts, reusing vectors from the on-disk cache where the content is unchanged.
+        """
+        hashes = [content_hash(chunk.page_content) for chunk in chunks]
+        vectors = self.chunk_embedding_cache.get_many(hashes)
+        missing = {h: chunk.page_content for h, chunk in zip(hashes, chunks) if h not in vectors}
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), new_vectors))
+            self.chunk_embedding_cache.put_many(new_vectors)
+            vectors.update(new_vectors)
+        return [vectors[h] for h in hashes], len(missing)
+
+    def get_chunk_texts(self, ids):
+        """
+        Return {chunk_id: text} for stored chunk references (e.g. citations in chat history).
+        Served from the lexical index docstore, falling back to the vector store.
+        """
+        ids = list(dict.fromkeys(ids))
+        texts = self.lexical_index.get_texts(ids)
+        missing = [chunk_id for chunk_id in ids if chunk_id not in texts]
+        if not missing or (self.vector_db is None and not self.load_index()):
+            return texts
         try:
-            self.vector_db = PineconeVectorStore.from_documents(
-                documents=chunks,
-                embedding=self.embeddings, 
-                index_name=self.index_name,
-            )
-            print("Vector database created successfully.")
-            return self.vector_db
+            if self.is_local:
+                texts.update({doc.id: doc.page_content for doc in self.vector_db.get_by_ids(missing)})
+            else:
+                for start in range(0, len(missing), 100):
+                    response = self.vector_db.index.fetch(ids=missing[start:start + 100])
+                    for chunk_id, vector in response.vectors.items():
+                        texts[chunk_id] = (vector.metadata or {}).get("text", "")
         except Exception as e:
+            print(f"Error fetching chunk texts: {e}")
+        return texts
+
+    def chunk_vectors(self, documents):
+        """
+        Embeddings of retrieved chunks, read from the vector store (never embedded on
+        the chat path). Returns None if any of them isn't stored, so the caller keeps
+        the retrieval order.
+        """
+        ids = [_document_key(doc) for doc in documents]
+        try:
+            if self.is_local:
+                vectors = self.vector_db.get_vectors(ids)
+            else:
+                vectors = {}
+                unique = list(dict.fromkeys(ids))
+                for start in range(0, len(unique), 100):
+                    response = self.vector_db.index.fetch(ids=unique[start:start + 100])
+                    vectors.update({chunk_id: vector.values for chunk_id, vector in response.vectors.items()})
+        except Exception as e:
+            print(f"Error fetching chunk vectors, keeping retrieval order: {e}")
+            return None
+        if not all(chunk_id in vectors for chunk_id in ids):
+            return None
+        return [vectors[chunk_id] for chunk_id in ids]
+
+    def pack_context(self, documents, query_embedding=None):
+        """
+        Merge overlapping chunks, rerank with MMR (relevance = retrieval rank) and trim
+        to CONTEXT_TOKEN_BUDGET. documents must be in retrieval (fused) order.
+        """
+        return self.context_packer.run(documents, query_embedding, self.chunk_vectors)
+
+    def _upsert_batch(self, chunks, vectors):
+        texts = [chunk.page_content for chunk in chunks]
+        metadatas = [dict(chunk.metadata) for chunk in chunks]
+        ids = [metadata["chunk_id"] for metadata in metadatas]
+
+        if self.is_local:
+            self.vector_db.add_embeddings(texts, vectors, metadatas, ids)
+            self.lexical_index.add_many(ids, texts, metadatas)
+            return len(ids)
+
+        # PineconeVectorStore keeps the chunk text under the "text" metadata key
+        records = [
+            {"id": chunk_id, "values": list(vector), "metadata": {**metadata, "text": text}}
+            for chunk_id, text, vector, metadata in zip(ids, texts, vectors, metadatas)
+        ]
+        self.vector_db.index.upsert(vectors=records)
+        self.lexical_index.add_many(ids, texts, metadatas)
+        return len(ids)
+
+    def _existing_ids(self, source):
+        ids = set(self.list_chunk_ids(source))
+        if not ids:
+            # Nothing under content-hashed ids: clear chunks indexed with the old random ids
+            try:
+                if self.is_local:
+                    self.vector_db.delete(filter={"source": source})
+                else:
+                    self.vector_db.index.delete(filter={"source": source})
+            except Exception as e:
+                print(f"Error clearing legacy chunks for {source}: {e}")
+        return ids
+
+    def create_vector_db(self, documents, progress_callback=None):
+        """
+        Create (or update) the vector database from an iterable of Documents.
+
+        Pages are split and embedded in batches of EMBED_BATCH_SIZE chunks while up to
+        UPSERT_CONCURRENCY batches are being written, so memory stays bounded
+        whatever the corpus size. Returns per-stage statistics, or None on failure.
+
+        Chunk ids are derived from source, page and content hash, so re-ingesting a file
+        only embeds and upserts new chunks, and deletes the ones that disappeared.
+        """
+        if not self.is_configured():
+            print("Missing documents, API key, or index name.")
+            return None
+
+        if not self._open_for_writes():
+            return None
+
+        stats = IngestStats()
+        existing = {}  # source -> chunk ids indexed before this run
+        seen = {}  # source -> chunk ids produced by this run
+        pages = _Counter(documents)
+        batches = _batched(self.iter_chunks(pages), EMBED_BATCH_SIZE)
+
+        try:
+            with ThreadPoolExecutor(max_workers=UPSERT_CONCURRENCY) as pool:
+                in_flight = set()
+                while True:
+                    started = time.perf_counter()
+                    batch = next(batches, None)
+                    stats.split_seconds += time.perf_counter() - started
+                    if batch is None:
+                        break
+                    stats.pages = pages.count
+                    stats.chunks += len(batch)
+
+                    new_chunks = []
+                    for chunk in batch:
+                        source = chunk.metadata["source"]
+                        if source not in existing:
+                            existing[source] = self._existing_ids(source)
+                            seen[source] = set()
+                        chunk.metadata["chunk_id"] = chunk_id(source, chunk.page_content, chunk.metadata.get("page"))
+                        if chunk.metadata["chunk_id"] in seen[source]:
+                            stats.duplicates += 1
+                            continue
+                        seen[source].add(chunk.metadata["chunk_id"])
+                        if chunk.metadata["chunk_id"] in existing[source]:
+                            stats.skipped += 1
+                            # Backfill chunks indexed before the lexical index existed
+                            if chunk.metadata["chunk_id"] not in self.lexical_index:
+                                self.lexical_index.add_many(
+                                    [chunk.metadata["chunk_id"]], [chunk.page_content], [chunk.metadata]
+                                )
+                        else:
+                            new_chunks.append(chunk)
+                    if not new_chunks:
+                        continue
+                    batch = new_chunks
+
+                    started = time.perf_counter()
+                    vectors, embedded = self.embed_chunks(batch)
+                    stats.embedded += embedded
+                    stats.embed_seconds += time.perf_counter() - started
+
+                    # Keep at most UPSERT_CONCURRENCY batches in flight
+                    while len(in_flight) >= UPSERT_CONCURRENCY:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        stats.collect(done)
+                    in_flight.add(pool.submit(stats.timed_upsert, self._upsert_batch, batch, vectors))
+
+                    if progress_callback:
+                        progress_callback(stats.as_dict())
+
+                done, _ = wait(in_flight)
+                stats.collect(done)
+            stats.pages = pages.count
+
+            # Chunks of re-ingested sources that are no longer in the text
+            for source, ids in existing.items():
+                vanished = ids - seen[source]
+                if vanished:
+                    self.delete_chunk_ids(vanished)
+                    stats.deleted += len(vanished)
+
+            self.save_index()
+            self._bump_index_version()
+            if progress_callback:
+                progress_callback(stats.as_dict())
+            print(f"Vector database created successfully: {stats.as_dict()}")
+            return stats.as_dict()
+        except Exception as e:
+            # Chunks already written stay in the index; make sure cached results don't hide them
+            self._bump_index_version()
             print(f"Error creating vector database: {e}")
             return None
 
-    def retrieve(self, query, k=20):
+    def embed_query(self, query):
+        # The model is cased (law and article names), so case is kept: the key only
+        # folds Unicode normalization and whitespace differences together
+        key = normalize_query(query, lower=False)
+        embedding = self._embedding_cache.get(key)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(query)
+            self._embedding_cache.set(key, embedding)
+        return embedding
+
+    def search(self, embedding, k=None):
         """
-        Retrieve the top k most relevant document chunks for a query.
+        Return the top k chunks closest to a query embedding.
         """
+        k = k or RETRIEVE_K
         if self.vector_db is None:
             # Try to connect if not already connected
             if not self.load_index():
                 return []
-        
-        return self.vector_db.similarity_search(query, k=k)
+
+        key = (_embedding_key(embedding), k, self.index_version)
+        results = self._result_cache.get(key)
+        if results is None:
+            results = self.vector_db.similarity_search_by_vector(embedding, k=k)
+            # Only cache if no index write happened while we were searching
+            if key[2] == self.index_version:
+                self._result_cache.set(key, results)
+        return list(results)
+
+    def lexical_search(self, query, k=None):
+        """
+        Return the top k chunks by BM25 score; chunks of an article cited in the
+        query ("Điều 36") come first.
+        """
+        results = self.lexical_index.search(query, k=k or RETRIEVE_K)
+        cited = {"Điều " + number for number in ARTICLE_REF_RE.findall(normalize_query(query))}
+        if cited:
+            results.sort(key=lambda doc: doc.metadata.get("article") not in cited)
+        return results
+
+    def hybrid_search(self, query, embedding, k=None):
+        """
+        Fuse the dense and BM25 rankings with reciprocal rank fusion.
+        Exact terms (article numbers, decree numbers) are found by BM25, paraphrases by
+        the vector index, so k candidates from each are enough.
+        """
+        k = k or RETRIEVE_K
+        dense = self.search(embedding, k=k)
+        return reciprocal_rank_fusion([dense, self.lexical_search(query, k=k)])[:k]
+
+    def retrieve(self, query, k=None):
+        """
+        Retrieve the top k most relevant document chunks for a query.
+        """
+        if is_citation_query(query):
+            results = self.lexical_search(query, k=k)
+            if results:
+                return results
+        if self.vector_db is None and not self.load_index():
+            return self.lexical_search(query, k=k)
+        return self.hybrid_search(query, self.embed_query(query), k=k)
+
+    async def aembed_query(self, query):
+        key = normalize_query(query, lower=False)
+        embedding = self._embedding_cache.get(key)
+        if embedding is not None:
+            return embedding
+        # Encoded together with other queries arriving at the same time
+        embedding = await get_embedding_service(self.embedding_engine).embed(query)
+        self._embedding_cache.set(key, embedding)
+        return embedding
+
+    async def asearch(self, embedding, k=None):
+        async with _search_semaphore:
+            return await asyncio.to_thread(self.search, embedding, k)
+
+    async def alexical_search(self, query, k=None):
+        async with _search_semaphore:
+            return await asyncio.to_thread(self.lexical_search, query, k)
+
+    async def ahybrid_search(self, query, embedding, k=None):
+        async with _search_semaphore:
+            return await asyncio.to_thread(self.hybrid_search, query, embedding, k)
+
+    async def apack_context(self, documents, query_embedding=None):
+        async with _search_semaphore:
+            return await asyncio.to_thread(self.pack_context, documents, query_embedding)
+
+    async def aretrieve(self, query, k=None):
+        """
+        Async version of retrieve: embedding and index queries run in worker
+        threads so the event loop keeps serving other requests.
+        """
+        if is_citation_query(query):
+            results = await self.alexical_search(query, k=k)
+            if results:
+                return results
+        if self.vector_db is None:
+            async with _search_semaphore:
+                if not await asyncio.to_thread(self.load_index):
+                    return await self.alexical_search(query, k=k)
+        embedding = await self.aembed_query(query)
+        return await self.ahybrid_search(query, embedding, k=k)
 
     def save_index(self, folder_path=None):
         """
-        Pinecone saves automatically to the cloud. This is a placeholder.
+        Persist the local index to folder_path (defaults to index_path), and the BM25 index.
+        Pinecone saves automatically to the cloud, so there is nothing to do for it.
         """
-        return True
+        try:
+            self.lexical_index.save(self.lexical_index_path)
+        except Exception as e:
+            print(f"Error saving lexical index: {e}")
+        if not self.is_local:
+            return True
+        if self.vector_db is None:
+            return False
+        try:
+            return self.vector_db.save(folder_path or self.index_path)
+        except Exception as e:
+            print(f"Error saving index: {e}")
+            return False
 
     def load_index(self, folder_path=None):
         """
-        Connect to the existing Pinecone index.
+        Open the local index from folder_path (defaults to index_path),
+        or connect to the existing Pinecone index.
         """
+        if self.is_local:
+            folder_path = folder_path or self.index_path
+            if not LocalVectorStore.exists(folder_path):
+                return False
+            try:
+                self.vector_db = LocalVectorStore.load(folder_path, self.embeddings)
+                return True
+            except Exception as e:
+                print(f"Error loading index: {e}")
+                return False
+
         if not self.pinecone_api_key or not self.index_name:
             return False
             
@@ -138,20 +766,22 @@ class RAGSystem:
             return False
     def deleteAll(self):
         """
-        Delete all vectors in the Pinecone index.
+        Delete all vectors in the index.
         """
         if self.vector_db is None:
             if not self.load_index():
                 return False
         try:
             self.vector_db.delete(delete_all=True)
-            return True
+            self.lexical_index.delete_all()
+            self._bump_index_version()
+            return self.save_index()
         except Exception as e:
             print(f"Error deleting vectors: {e}")
             return False
     def deleteSource(self, source: str):
         """
-        Delete specific vectors by source in the Pinecone index.
+        Delete specific vectors by source in the index.
         """
         if self.vector_db is None:
             if not self.load_index():
@@ -159,7 +789,13 @@ class RAGSystem:
         try:
             print(f"Attempting to delete vectors with source: {source}")
             
-            self.vector_db.index.delete(filter={"source": source})
+            self.lexical_index.delete_prefix(source_prefix(source))
+            if self.is_local:
+                self.vector_db.delete(filter={"source": source})
+            else:
+                self.vector_db.index.delete(filter={"source": source})
+            self.save_index()
+            self._bump_index_version()
             
             print(f"Successfully deleted vectors with source: {source}")
             return True
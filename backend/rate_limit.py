@@ -0,0 +1,185 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from fastapi import HTTPException, Request
+from pymongo import ReturnDocument
+
+# Daily chat requests per tier; 0 means unlimited (and no counter write at all)
+TIER_LIMITS = {
+    "free": int(os.getenv("QUOTA_FREE", 5)),
+    "premium": int(os.getenv("QUOTA_PREMIUM", 0)),
+    "own_key": int(os.getenv("QUOTA_OWN_KEY", 0)),
+}
+
+# Only trust X-Forwarded-For behind a reverse proxy that sets it
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+
+
+class UsageQuota:
+    """
+    Daily per-user request quota enforced with one atomic find_one_and_update.
+
+    The filter only matches while the user is under the limit (or the counter is
+    from a previous day), and the pipeline update resets or increments the counter
+    in the same write, so concurrent requests cannot race past the limit.
+    """
+
+    def __init__(self, users_collection, limits=None):
+        self.users = users_collection
+        self.limits = limits or TIER_LIMITS
+
+    def limit(self, tier):
+        return self.limits.get(tier, 0)
+
+    async def consume(self, username, tier):
+        """
+        Count one request against today's quota. Returns the user's count after this
+        request (None for unlimited tiers), or False when the limit is reached.
+        """
+        limit = self.limit(tier)
+        if not limit:
+            return None
+
+        now = datetime.utcnow()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        user = await self.users.find_one_and_update(
+            {
+                "username": username,
+                "$or": [
+                    {"last_usage_date": None},
+                    {"last_usage_date": {"$lt": today}},
+                    {"daily_usage_count": {"$lt": limit}},
+                ],
+            },
+            [
+                {
+                    "$set": {
+                        "daily_usage_count": {
+                            "$cond": [
+                                {"$lt": [{"$ifNull": ["$last_usage_date", datetime(1970, 1, 1)]}, today]},
+                                1,
+                                {"$add": [{"$ifNull": ["$daily_usage_count", 0]}, 1]},
+                            ]
+                        },
+                        "last_usage_date": now,
+                    }
+                }
+            ],
+            projection={"daily_usage_count": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if user is None:
+            return False
+        return user["daily_usage_count"]
+
+
+class TokenBucketLimiter:
+    """
+    In-memory token bucket per key (client IP or user): `burst` requests at once, refilled
+    at `rate` requests per second. Only the most recent max_keys keys are tracked.
+    """
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def acquire(self, key):
+        """
+        Take one token for key. Returns 0 if allowed, otherwise seconds until a token is available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+                self.allowed += 1
+            else:
+                wait = (1 - tokens) / self.rate
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self):
+        return {"keys": len(self._buckets), "allowed": self.allowed, "rejected": self.rejected}
+
+
+class ConcurrencyLimiter:
+    """
+    At most max_per_key jobs running at once per key (user).
+    """
+
+    def __init__(self, max_per_key):
+        self.max_per_key = max_per_key
+        self._running = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def acquire(self, key):
+        """
+        Start a job for key. Returns a release() function (safe to call more than
+        once), or None when key already has max_per_key jobs running.
+        """
+        with self._lock:
+            if self._running.get(key, 0) >= self.max_per_key:
+                self.rejected += 1
+                return None
+            self._running[key] = self._running.get(key, 0) + 1
+        released = False
+
+        def release():
+            nonlocal released
+            with self._lock:
+                if released:
+                    return
+                released = True
+                self._running[key] -= 1
+                if not self._running[key]:
+                    del self._running[key]
+
+        return release
+
+    def stats(self):
+        with self._lock:
+            return {"running": sum(self._running.values()), "keys": len(self._running), "rejected": self.rejected}
+
+
+def client_ip(request: Request):
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded and TRUST_FORWARDED_FOR:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def check_rate(limiter: TokenBucketLimiter, key):
+    """
+    Take a token for key, or raise 429 Too Many Requests with Retry-After.
+    """
+    wait = limiter.acquire(key)
+    if wait:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests. Please try again later.",
+            headers={"Retry-After": str(max(1, round(wait)))},
+        )
+
+
+def rate_limit(limiter: TokenBucketLimiter):
+    """
+    FastAPI dependency rejecting bursts from one IP with 429 Too Many Requests.
+    """
+
+    async def dependency(request: Request):
+        check_rate(limiter, client_ip(request))
+
+    return dependency
@@ -1,17 +1,29 @@
 import os
 import base64
-from cryptography.fernet import Fernet
+from functools import lru_cache
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from dotenv import load_dotenv
+from cache import LRUCache
 
 load_dotenv()
 
 # Get the secret key from environment or use a default (NOT RECOMMENDED FOR PRODUCTION)
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-should-be-changed-in-production")
+# Comma-separated secrets used before the current SECRET_KEY; tokens encrypted with them
+# still decrypt and are re-encrypted with SECRET_KEY on next use
+SECRET_KEY_PREVIOUS = [key.strip() for key in os.getenv("SECRET_KEY_PREVIOUS", "").split(",") if key.strip()]
 
-def _get_fernet():
-    # Derive a 32-byte key from the SECRET_KEY using PBKDF2
+# Decrypted per-user API keys, so chat requests skip Fernet decryption
+KEY_CACHE_SIZE = int(os.getenv("KEY_CACHE_SIZE", 1024))
+KEY_CACHE_TTL = int(os.getenv("KEY_CACHE_TTL", 600))
+_key_cache = LRUCache(maxsize=KEY_CACHE_SIZE, ttl=KEY_CACHE_TTL)
+
+
+@lru_cache(maxsize=None)
+def _derive_fernet(secret):
+    # Derive a 32-byte key from the secret using PBKDF2 (slow by design, so once per process)
     # This ensures we have a valid url-safe base64-encoded key for Fernet
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(),
@@ -19,9 +31,19 @@ def _get_fernet():
         salt=b'static_salt_for_mvp', # In production, salt should be unique or managed better
         iterations=100000,
     )
-    key = base64.urlsafe_b64encode(kdf.derive(SECRET_KEY.encode()))
+    key = base64.urlsafe_b64encode(kdf.derive(secret.encode()))
     return Fernet(key)
 
+@lru_cache(maxsize=None)
+def _get_multi_fernet(secret, previous):
+    return MultiFernet([_derive_fernet(secret)] + [_derive_fernet(key) for key in previous])
+
+def _get_fernet():
+    """
+    MultiFernet that encrypts with SECRET_KEY and decrypts with it or any previous key.
+    """
+    return _get_multi_fernet(SECRET_KEY, tuple(SECRET_KEY_PREVIOUS))
+
 def encrypt_key(key: str) -> str:
     if not key:
         return None
@@ -36,3 +58,43 @@ def decrypt_key(token: str) -> str:
         return f.decrypt(token.encode()).decode()
     except Exception:
         return None
+
+def cached_user_key(username: str, token: str):
+    """
+    The decrypted key of a user from the cache, or None. The cached entry is only
+    used while it was decrypted from the same token the user record holds now.
+    """
+    cached = _key_cache.get(username)
+    if cached and cached[0] == token:
+        return cached[1]
+    return None
+
+def decrypt_user_key(username: str, token: str):
+    """
+    Decrypt a user's stored API key and cache it. Returns (key, rotated_token):
+    rotated_token is the key re-encrypted with the current SECRET_KEY when the
+    stored token was made with a previous one (None otherwise), so callers can
+    persist it and rotate keys lazily instead of in one bulk re-encrypt.
+    """
+    if not token:
+        return None, None
+    key = cached_user_key(username, token)
+    if key:
+        return key, None
+
+    rotated_token = None
+    try:
+        key = _derive_fernet(SECRET_KEY).decrypt(token.encode()).decode()
+    except InvalidToken:
+        key = decrypt_key(token)
+        if key:
+            rotated_token = encrypt_key(key)
+    if key:
+        _key_cache.set(username, (rotated_token or token, key))
+    return key, rotated_token
+
+def invalidate_user_key(username: str):
+    _key_cache.pop(username)
+
+def key_cache_stats():
+    return _key_cache.stats()
@@ -0,0 +1,143 @@
+import io
+import os
+import re
+import json
+import time
+import hashlib
+import tempfile
+import requests
+from docxtpl import DocxTemplate
+from cache import LRUCache
+
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR") or os.path.join(
+    tempfile.gettempdir(), "legal_chatbot_templates"
+)
+# Templates kept in memory (the disk cache holds all of them)
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", 32))
+# Seconds a cached template is served without asking the storage whether it changed
+TEMPLATE_REVALIDATE_SECONDS = int(os.getenv("TEMPLATE_REVALIDATE_SECONDS", 3600))
+
+
+def parse_template(data):
+    """
+    Variables ({{name}} placeholders, as {name: ""}) and paragraph text of a .docx template.
+    """
+    doc = DocxTemplate(io.BytesIO(data))
+    txt = "\n".join([p.text for p in doc.get_docx().paragraphs if p.text])
+    vars = set(re.findall(r"{{(.*?)}}", txt))
+    return {var_name: "" for var_name in vars}, txt
+
+
+def render_template(data, context):
+    """
+    Fill a .docx template (bytes) with context and return the rendered .docx bytes.
+    Works entirely in memory, so concurrent renders never share a file.
+    """
+    doc = DocxTemplate(io.BytesIO(data))
+    doc.render(context)
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+class TemplateCache:
+    """
+    Contract template bytes cached in memory and on disk, keyed by file name.
+
+    A cached template is returned without any network I/O. Once it is older than
+    revalidate_seconds it is revalidated with a conditional GET (If-None-Match
+    with the stored ETag): a 304 only refreshes the check time, a 200 replaces
+    it. If the storage can't be reached, the cached copy keeps being served.
+    """
+
+    def __init__(self, cache_dir=TEMPLATE_CACHE_DIR, maxsize=TEMPLATE_CACHE_SIZE, revalidate_seconds=TEMPLATE_REVALIDATE_SECONDS):
+        self.cache_dir = cache_dir
+        self.revalidate_seconds = revalidate_seconds
+        self._memory = LRUCache(maxsize=maxsize)
+        self.downloads = 0
+        self.not_modified = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _paths(self, filename):
+        name = hashlib.sha256(filename.encode("utf-8")).hexdigest()[:32]
+        base = os.path.join(self.cache_dir, name)
+        return base + ".docx", base + ".json"
+
+    def _load(self, filename):
+        entry = self._memory.get(filename)
+        if entry is not None:
+            return entry
+        data_path, meta_path = self._paths(filename)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(data_path, "rb") as f:
+                entry = {"data": f.read(), "etag": meta.get("etag"), "checked": meta.get("checked", 0)}
+        except (OSError, ValueError):
+            return None
+        self._memory.set(filename, entry)
+        return entry
+
+    def _replace(self, path, data):
+        # Write to a unique temp file then rename, so a crash never leaves a truncated
+        # file behind and concurrent writers of the same template never share a temp file
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _store(self, filename, entry, data_changed=True):
+        self._memory.set(filename, entry)
+        data_path, meta_path = self._paths(filename)
+        if data_changed:
+            self._replace(data_path, entry["data"])
+        meta = {"filename": filename, "etag": entry["etag"], "checked": entry["checked"]}
+        self._replace(meta_path, json.dumps(meta).encode("utf-8"))
+
+    def _fetch(self, filename, url, entry=None):
+        headers = {"If-None-Match": entry["etag"]} if entry and entry["etag"] else {}
+        r = requests.get(url, headers=headers, timeout=30)
+        if r.status_code == 304 and entry:
+            self.not_modified += 1
+            entry = {**entry, "checked": time.time()}
+            self._store(filename, entry, data_changed=False)
+            return entry
+        r.raise_for_status()
+        self.downloads += 1
+        entry = {"data": r.content, "etag": r.headers.get("ETag"), "checked": time.time()}
+        self._store(filename, entry)
+        return entry
+
+    def get(self, filename, url):
+        """
+        The template's bytes, downloaded from url only when not cached (or stale and changed).
+        """
+        entry = self._load(filename)
+        if entry is None:
+            return self._fetch(filename, url)["data"]
+        if time.time() - entry["checked"] > self.revalidate_seconds:
+            try:
+                entry = self._fetch(filename, url, entry)
+            except requests.RequestException as e:
+                print(f"Could not revalidate template {filename}, serving cached copy: {e}")
+        return entry["data"]
+
+    def refresh(self, filename, url):
+        """
+        Download the template again, ignoring the cache (e.g. after an admin re-uploads it).
+        """
+        return self._fetch(filename, url)["data"]
+
+    def file_path(self, filename):
+        """
+        Path of the template in the disk cache (there once get() or refresh() returned it).
+        """
+        return self._paths(filename)[0]
+
+    def stats(self):
+        return {**self._memory.stats(), "downloads": self.downloads, "not_modified": self.not_modified}
@@ -0,0 +1,91 @@
+"""
+Explain-plan check for the hot MongoDB queries.
+
+Creates the indexes from db_indexes.py in a scratch database and explains every
+query the API runs on a hot path; a query falling back to a COLLSCAN fails.
+Skipped when no MongoDB answers at MONGO_URI.
+
+    MONGO_URI=mongodb://localhost:27017 python -m pytest tests/test_db_indexes.py
+"""
+import os
+import asyncio
+from datetime import datetime
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from motor.motor_asyncio import AsyncIOMotorClient
+from db_indexes import ensure_indexes
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+TEST_DB = os.getenv("TEST_MONGO_DB", "legal_chatbot_index_check")
+
+# (collection, filter, sort) for every hot query in main.py / auth.py / ingestion.py / message_store.py
+HOT_QUERIES = [
+    ("users", {"username": "alice"}, None),
+    ("users", {"email": "alice@example.com"}, None),
+    ("users", {"verification_token": "token"}, None),
+    ("users", {"reset_token": "token"}, None),
+    ("conversations", {"session_id": "s1", "user_id": "alice"}, None),
+    ("conversations", {"user_id": "alice"}, [("updated_at", -1), ("_id", -1)]),
+    ("messages", {"session_id": "s1", "user_id": "alice", "seq": {"$lt": 100}}, [("seq", -1)]),
+    ("files", {"filename": "luat.pdf"}, None),
+    ("files", {"filename": "luat.pdf", "job_id": "job"}, None),
+    ("contracts", {"filename": "hop_dong.docx"}, None),
+    ("ingest_jobs", {"status": {"$in": ["queued", "running"]}}, None),
+]
+
+
+def stages(plan):
+    """
+    Every "stage" name in an explain plan tree.
+    """
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from stages(value)
+
+
+async def _ensure_indexes():
+    client = AsyncIOMotorClient(MONGO_URI, serverSelectionTimeoutMS=2000)
+    try:
+        await ensure_indexes(client[TEST_DB])
+    finally:
+        client.close()
+
+
+@pytest.fixture(scope="module")
+def db():
+    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError as e:
+        client.close()
+        pytest.skip(f"No MongoDB at {MONGO_URI}: {e}")
+    client.drop_database(TEST_DB)
+    db = client[TEST_DB]
+    # A few documents so the planner has something to choose from
+    db.users.insert_one({"username": "bob", "email": "bob@example.com", "verification_token": None, "reset_token": None})
+    db.conversations.insert_one({"session_id": "s0", "user_id": "bob", "updated_at": datetime.utcnow()})
+    asyncio.run(_ensure_indexes())
+    yield db
+    client.drop_database(TEST_DB)
+    client.close()
+
+
+@pytest.mark.parametrize("collection, query, sort", HOT_QUERIES)
+def test_hot_query_uses_an_index(db, collection, query, sort):
+    cursor = db[collection].find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    used = set(stages(cursor.explain()["queryPlanner"]["winningPlan"]))
+    assert "COLLSCAN" not in used, f"{collection} {query} sort={sort} scans the collection: {sorted(used)}"
+
+
+def test_one_conversation_per_user_session(db):
+    db.conversations.insert_one({"session_id": "s1", "user_id": "alice", "updated_at": datetime.utcnow()})
+    with pytest.raises(DuplicateKeyError):
+        db.conversations.insert_one({"session_id": "s1", "user_id": "alice", "updated_at": datetime.utcnow()})
@@ -0,0 +1,369 @@
+import os
+import json
+import mmap
+import uuid
+import threading
+import numpy as np
+import faiss
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process HNSW index (FAISS) with a memory-mapped docstore.
+
+    On disk a saved index is a folder containing:
+      - index.faiss     the HNSW graph (inner product over normalized vectors = cosine)
+      - vectors.npy     raw normalized vectors, used to rebuild after deletions
+      - ids.json        chunk ids, in index order
+      - deleted.json    positions of deleted rows, still in the graph but never returned
+      - docstore.jsonl  one {"text", "metadata"} record per line
+      - offsets.npy     byte offset of every docstore line
+
+    Saves are incremental: new rows are appended and deletions are only recorded,
+    until more than compact_ratio of the rows are deleted and the graph is rebuilt
+    without them.
+    """
+
+    INDEX_FILE = "index.faiss"
+    VECTORS_FILE = "vectors.npy"
+    IDS_FILE = "ids.json"
+    DELETED_FILE = "deleted.json"
+    DOCSTORE_FILE = "docstore.jsonl"
+    OFFSETS_FILE = "offsets.npy"
+
+    def __init__(self, embedding, dimension=768, hnsw_m=32, ef_construction=200, ef_search=128, compact_ratio=0.2):
+        self.embedding = embedding
+        self.dimension = dimension
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.compact_ratio = compact_ratio
+        # Serialises graph mutations against searches (FAISS is not safe for concurrent add + search)
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.index = self._new_index()
+        # Vectors of the saved index (memory-mapped) and batches added since
+        self._vectors = np.zeros((0, self.dimension), dtype="float32")
+        self._new_vectors = []
+        self._ids = []
+        self._id_to_pos = {}
+        self._deleted = set()
+        self._selector = None
+
+        # Docstore: records loaded from disk are read lazily through mmap,
+        # records added since the last save are kept in memory.
+        self._docstore_file = None
+        self._docstore_mmap = None
+        self._offsets = np.zeros(1, dtype="int64")
+        self._new_docs = {}
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def _new_index(self):
+        index = faiss.IndexHNSWFlat(self.dimension, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = self.ef_construction
+        index.hnsw.efSearch = self.ef_search
+        return index
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype="float32")
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def __len__(self):
+        return len(self._ids) - len(self._deleted)
+
+    # ------------------------------------------------------------------
+    # Docstore
+    # ------------------------------------------------------------------
+    def _get_record(self, pos):
+        if pos in self._new_docs:
+            return self._new_docs[pos]
+        start, end = int(self._offsets[pos]), int(self._offsets[pos + 1])
+        return json.loads(self._docstore_mmap[start:end].decode("utf-8"))
+
+    def _get_document(self, pos):
+        record = self._get_record(pos)
+        return Document(id=self._ids[pos], page_content=record["text"], metadata=record["metadata"])
+
+    def _close_docstore(self):
+        if self._docstore_mmap is not None:
+            self._docstore_mmap.close()
+            self._docstore_mmap = None
+        if self._docstore_file is not None:
+            self._docstore_file.close()
+            self._docstore_file = None
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        """
+        Add pre-computed embeddings. Re-adding an existing id replaces it.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+
+        vectors = self._normalize(embeddings)
+        with self._lock:
+            replaced = [self._id_to_pos[i] for i in ids if i in self._id_to_pos]
+            if replaced:
+                self._deleted.update(replaced)
+                self._selector = None
+
+            start = len(self._ids)
+            self.index.add(vectors)
+            # Joined with the saved vectors only when saving
+            self._new_vectors.append(vectors)
+            for offset, (chunk_id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+                pos = start + offset
+                self._ids.append(chunk_id)
+                self._id_to_pos[chunk_id] = pos
+                self._new_docs[pos] = {"text": text, "metadata": dict(metadata)}
+        return list(ids)
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        vectors = self.embedding.embed_documents(texts)
+        return self.add_embeddings(texts, vectors, metadatas, ids)
+
+    def delete(self, ids=None, delete_all=False, filter=None, **kwargs):
+        """
+        Delete by ids, by metadata equality filter, or everything.
+        Deleted rows are tombstoned and dropped from the graph on the next save().
+        """
+        with self._lock:
+            if delete_all:
+                self._close_docstore()
+                self._reset()
+                return True
+
+            positions = set()
+            if ids:
+                positions.update(self._id_to_pos[i] for i in ids if i in self._id_to_pos)
+            if filter:
+                for pos in range(len(self._ids)):
+                    if pos in self._deleted:
+                        continue
+                    metadata = self._get_record(pos)["metadata"]
+                    if all(metadata.get(key) == value for key, value in filter.items()):
+                        positions.add(pos)
+
+            for pos in positions:
+                self._id_to_pos.pop(self._ids[pos], None)
+            if positions:
+                self._deleted.update(positions)
+                self._selector = None
+        return True
+
+    def _search_params(self, fetch_k):
+        params = faiss.SearchParametersHNSW(efSearch=max(self.ef_search, fetch_k))
+        if self._deleted:
+            # Deleted rows stay in the graph until compaction; keep them out of the results
+            if self._selector is None:
+                deleted = faiss.IDSelectorBatch(np.fromiter(self._deleted, dtype="int64"))
+                # IDSelectorNot doesn't own the selector it wraps: keep both alive
+                self._selector = (faiss.IDSelectorNot(deleted), deleted)
+            params.sel = self._selector[0]
+        return params
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None):
+        query = self._normalize(embedding)
+        # Positions are only valid until the next save() compacts the rows,
+        # so documents are resolved under the same lock as the search
+        with self._lock:
+            if len(self) == 0:
+                return []
+            # Over-fetch to make up for filtered-out rows
+            fetch_k = min(len(self), k + (k * 4 if filter else 0))
+            scores, positions = self.index.search(query, fetch_k, params=self._search_params(fetch_k))
+
+            results = []
+            for score, pos in zip(scores[0], positions[0]):
+                if pos < 0 or pos in self._deleted:
+                    continue
+                doc = self._get_document(int(pos))
+                if filter and not all(doc.metadata.get(key) == value for key, value in filter.items()):
+                    continue
+                results.append((doc, float(score)))
+                if len(results) >= k:
+                    break
+        return results
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        embedding = self.embedding.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k, filter)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def list_ids(self, prefix=""):
+        with self._lock:
+            return [chunk_id for chunk_id in self._id_to_pos if chunk_id.startswith(prefix)]
+
+    def get_by_ids(self, ids):
+        with self._lock:
+            return [self._get_document(self._id_to_pos[i]) for i in ids if i in self._id_to_pos]
+
+    def get_vectors(self, ids):
+        """
+        Return {id: normalized vector} for the ids that are stored.
+        """
+        with self._lock:
+            found = {}
+            for chunk_id in ids:
+                pos = self._id_to_pos.get(chunk_id)
+                if pos is None:
+                    continue
+                for start, segment in self._segments():
+                    if pos < start + len(segment):
+                        found[chunk_id] = np.array(segment[pos - start])
+                        break
+            return found
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def save(self, folder_path):
+        """
+        Write the index to folder_path, compacting away deleted rows once they are more
+        than compact_ratio of all rows. Files are written next to the old ones and
+        swapped in with os.replace.
+        """
+        with self._lock:
+            return self._save(folder_path)
+
+    def _segments(self):
+        """
+        (first position, vectors) of the saved rows and of every batch added since.
+        """
+        start = 0
+        for vectors in [self._vectors, *self._new_vectors]:
+            yield start, vectors
+            start += len(vectors)
+
+    def _save(self, folder_path):
+        os.makedirs(folder_path, exist_ok=True)
+
+        def tmp(name):
+            return os.path.join(folder_path, name + ".tmp")
+
+        total = len(self._ids)
+        compact = bool(self._deleted) and len(self._deleted) > self.compact_ratio * total
+        if compact:
+            keep = [pos for pos in range(total) if pos not in self._deleted]
+            deleted = []
+        else:
+            keep = range(total)
+            deleted = sorted(self._deleted)
+
+        # Stream the vectors to disk segment by segment, without joining them in memory
+        vectors = np.lib.format.open_memmap(tmp(self.VECTORS_FILE), mode="w+", dtype="float32", shape=(len(keep), self.dimension))
+        dropped = np.fromiter(self._deleted, dtype="int64") if compact else None
+        row = 0
+        for start, segment in self._segments():
+            if compact:
+                segment = segment[~np.isin(np.arange(start, start + len(segment)), dropped)]
+            vectors[row:row + len(segment)] = segment
+            row += len(segment)
+
+        if compact:
+            index = self._new_index()
+            for start in range(0, len(vectors), 10000):
+                index.add(np.ascontiguousarray(vectors[start:start + 10000]))
+        else:
+            index = self.index
+        vectors.flush()
+        del vectors
+
+        # Saved records are copied as raw bytes unless rows are being dropped
+        saved = 0 if compact else len(self._offsets) - 1
+        offsets = [0] if compact else list(self._offsets[-1:])
+        with open(tmp(self.DOCSTORE_FILE), "wb") as f:
+            if saved and self._docstore_mmap is not None:
+                f.write(self._docstore_mmap[:])
+            for pos in (keep if compact else range(saved, total)):
+                line = json.dumps(self._get_record(pos), ensure_ascii=False).encode("utf-8") + b"\n"
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        offsets = np.concatenate([self._offsets[:saved], np.asarray(offsets, dtype="int64")])
+
+        faiss.write_index(index, tmp(self.INDEX_FILE))
+        with open(tmp(self.OFFSETS_FILE), "wb") as f:
+            np.save(f, offsets)
+        with open(tmp(self.IDS_FILE), "w", encoding="utf-8") as f:
+            json.dump([self._ids[pos] for pos in keep], f, ensure_ascii=False)
+        with open(tmp(self.DELETED_FILE), "w", encoding="utf-8") as f:
+            json.dump(deleted, f)
+
+        # Release mmaps on the old files before replacing them (required on Windows)
+        self._vectors = None
+        self._new_vectors = []
+        self._offsets = None
+        self._close_docstore()
+        for name in (self.INDEX_FILE, self.VECTORS_FILE, self.OFFSETS_FILE, self.IDS_FILE, self.DELETED_FILE, self.DOCSTORE_FILE):
+            os.replace(tmp(name), os.path.join(folder_path, name))
+
+        self._open(folder_path, index=index)
+        return True
+
+    def _open(self, folder_path, index=None):
+        if index is None:
+            index = faiss.read_index(os.path.join(folder_path, self.INDEX_FILE))
+        index.hnsw.efSearch = self.ef_search
+        self.index = index
+
+        self._vectors = np.load(os.path.join(folder_path, self.VECTORS_FILE), mmap_mode="r")
+        self._new_vectors = []
+        self._offsets = np.load(os.path.join(folder_path, self.OFFSETS_FILE), mmap_mode="r")
+        with open(os.path.join(folder_path, self.IDS_FILE), "r", encoding="utf-8") as f:
+            self._ids = json.load(f)
+        # Indexes saved before deletions were recorded have no deleted.json
+        deleted_path = os.path.join(folder_path, self.DELETED_FILE)
+        if os.path.exists(deleted_path):
+            with open(deleted_path, "r", encoding="utf-8") as f:
+                self._deleted = set(json.load(f))
+        else:
+            self._deleted = set()
+        self._selector = None
+        self._id_to_pos = {chunk_id: pos for pos, chunk_id in enumerate(self._ids) if pos not in self._deleted}
+        self._new_docs = {}
+
+        self._docstore_file = open(os.path.join(folder_path, self.DOCSTORE_FILE), "rb")
+        if os.path.getsize(self._docstore_file.name) > 0:
+            self._docstore_mmap = mmap.mmap(self._docstore_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def exists(cls, folder_path):
+        return bool(folder_path) and os.path.exists(os.path.join(folder_path, cls.INDEX_FILE))
+
+    @classmethod
+    def load(cls, folder_path, embedding, **kwargs):
+        store = cls(embedding, **kwargs)
+        store._open(folder_path)
+        return store
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
@@ -214,7 +214,7 @@ export default function AdminDashboard() {
           size: file.size,
           upload_date: new Date().toISOString(),
           uploaded_by: "admin",
-          status: "processed",
+          status: "queued",
         })),
       ]);
       toast.success("Files sent to Pinecone successfully.");
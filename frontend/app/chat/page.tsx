@@ -8,7 +8,7 @@ import { useRouter } from "next/navigation";
 const API_URL = process.env.API_URL || "http://localhost:8000"  ;
 
 interface Source {
-  content: string;
+  content?: string;
   source: string;
   page?: number;
 }
@@ -34,6 +34,10 @@ export default function Home() {
   const [showSettings, setShowSettings] = useState(false);
   const [user, setUser] = useState<any>(null);
   const [history, setHistory] = useState<HistoryItem[]>([]);
+  // Cursor of the next page of conversations (X-Next-Cursor), null on the last page
+  const [historyCursor, setHistoryCursor] = useState<string | null>(null);
+  // Cursor (seq) of the previous page of the open session, null at its start
+  const [olderCursor, setOlderCursor] = useState<number | null>(null);
 
   const router = useRouter();
   const messagesEndRef = useRef<HTMLDivElement>(null);
@@ -80,27 +84,52 @@ export default function Home() {
         headers: { Authorization: `Bearer ${token}` },
       });
       setHistory(res.data);
+      setHistoryCursor(res.headers["x-next-cursor"] ?? null);
     } catch (error) {
       console.error("Failed to load history", error);
     }
   };
 
+  const loadMoreHistory = async () => {
+    if (!historyCursor) return;
+    const token = localStorage.getItem("token");
+    try {
+      const res = await axios.get(`${API_URL}/history`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { cursor: historyCursor },
+      });
+      setHistory((prev) => {
+        const known = new Set(prev.map((item) => item.session_id));
+        return [
+          ...prev,
+          ...res.data.filter((item: HistoryItem) => !known.has(item.session_id)),
+        ];
+      });
+      setHistoryCursor(res.headers["x-next-cursor"] ?? null);
+    } catch (error) {
+      console.error("Failed to load more history", error);
+    }
+  };
+
+  const mapMessages = (messages: any[]): Message[] =>
+    messages.map((m: any) => ({
+      role: m.role,
+      content: m.content,
+      sources: m.sources,
+    }));
+
   const loadSession = async (sid: string) => {
     const token = localStorage.getItem("token");
     try {
       setIsLoading(true);
       const res = await axios.get(`${API_URL}/history/${sid}`, {
         headers: { Authorization: `Bearer ${token}` },
+        params: { include_sources: true },
       });
 
       // Map backend messages to frontend format
-      const mappedMessages: Message[] = res.data.messages.map((m: any) => ({
-        role: m.role,
-        content: m.content,
-        sources: m.sources,
-      }));
-
-      setMessages(mappedMessages);
+      setMessages(mapMessages(res.data.messages));
+      setOlderCursor(res.data.next_cursor ?? null);
       setSessionId(sid);
     } catch (error) {
       console.error("Failed to load session", error);
@@ -109,8 +138,24 @@ export default function Home() {
     }
   };
 
+  const loadOlderMessages = async () => {
+    if (olderCursor === null) return;
+    const token = localStorage.getItem("token");
+    try {
+      const res = await axios.get(`${API_URL}/history/${sessionId}`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { before: olderCursor, include_sources: true },
+      });
+      setMessages((prev) => [...mapMessages(res.data.messages), ...prev]);
+      setOlderCursor(res.data.next_cursor ?? null);
+    } catch (error) {
+      console.error("Failed to load older messages", error);
+    }
+  };
+
   const startNewChat = () => {
     setMessages([]);
+    setOlderCursor(null);
     setSessionId(Math.random().toString(36).substring(7));
   };
 
@@ -412,6 +457,14 @@ export default function Home() {
                 <span className="truncate">{item.title}</span>
               </div>
             ))}
+            {historyCursor && (
+              <button
+                onClick={loadMoreHistory}
+                className="w-full p-2 text-xs text-slate-400 hover:text-slate-200 hover:bg-white/5 rounded-lg transition-all duration-200"
+              >
+                Xem thêm
+              </button>
+            )}
           </div>
         </div>
 
@@ -455,6 +508,12 @@ export default function Home() {
             </div>
           )}
 
+          {olderCursor !== null && (
+            <button onClick={loadOlderMessages} className="load-older-btn">
+              Xem tin nhắn cũ hơn
+            </button>
+          )}
+
           {messages.map((msg, idx) => (
             <div key={idx} className={`message ${msg.role}`}>
               <ReactMarkdown>{msg.content}</ReactMarkdown>
@@ -474,9 +533,16 @@ export default function Home() {
                                 📄 {src.source.split('/').pop()} 
                                 {src.page ? <span className="ml-2 badge bg-blue-100 text-blue-800 px-2 py-0.5 rounded-full text-xs">Trang {src.page}</span> : ''}
                             </div> */}
-                          <div className="text-gray-600 dark:text-gray-400 italic">
-                            "{src.content.substring(0, 200)}..."
-                          </div>
+                          {src.content ? (
+                            <div className="text-gray-600 dark:text-gray-400 italic">
+                              "{src.content.substring(0, 200)}..."
+                            </div>
+                          ) : (
+                            <div className="text-gray-600 dark:text-gray-400">
+                              📄 {src.source.split("/").pop()}
+                              {src.page ? ` - Trang ${src.page}` : ""}
+                            </div>
+                          )}
                         </div>
                       ))}
                     </div>
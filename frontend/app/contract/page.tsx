@@ -11,6 +11,7 @@ interface Message {
   role: "user" | "assistant";
   content: string;
   link: string;
+  filename?: string;
 }
 
 interface TemplateItem {
@@ -179,6 +180,7 @@ export default function Home() {
           variables: variabless,
           messages: messages,
           contentTemplate: contentTemplate,
+          filename: selectedTemplate?.filename,
         },
         {
           headers: { Authorization: `Bearer ${token}` },
@@ -191,6 +193,7 @@ export default function Home() {
           role: "assistant",
           content: res.data.response,
           link: res.data.link,
+          filename: res.data.filename,
         },
       ]);
       let vars = res.data.variables;
@@ -224,10 +227,10 @@ export default function Home() {
       setIsLoading(false);
     }
   };
-  const downloadFile = async (filename: string) => {
+  const downloadFile = async (artifactId: string, filename?: string) => {
     const token = localStorage.getItem("token");
     try {
-      const response = await axios.get(`${API_URL}/download/${filename}`, {
+      const response = await axios.get(`${API_URL}/download/${artifactId}`, {
         headers: { Authorization: `Bearer ${token}` },
         responseType: "blob", // Để nhận file dưới dạng blob
       });
@@ -236,7 +239,7 @@ export default function Home() {
       const url = window.URL.createObjectURL(new Blob([response.data]));
       const link = document.createElement("a");
       link.href = url;
-      link.setAttribute("download", filename); // Tên file khi tải xuống
+      link.setAttribute("download", filename || "hop_dong.docx"); // Tên file khi tải xuống
       document.body.appendChild(link);
       link.click();
       link.parentNode?.removeChild(link);
@@ -362,7 +365,7 @@ export default function Home() {
                     href="#"
                     onClick={(e) => {
                       e.preventDefault();
-                      downloadFile(msg.link);
+                      downloadFile(msg.link, msg.filename);
                     }}
                     className="text-black-400 font-semibold hover:text-green-200 bg-green-500 px-4 py-2 rounded inline-block mt-2 "
                   >